@@ -1,80 +1,231 @@
-import json
 import os
+import json
+import uuid
+import asyncio
+import tempfile
+import threading
+from itertools import islice
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import requests
 import pandas as pd
 import gradio as gr
+from columnar_output import is_columnar, iter_rows
+from streaming_json import iter_records
 
 # Scoring API endpoint
 API_SUBMIT_URL = "https://agents-course-unit4-scoring.hf.space/submit"
 
-def submit_existing_answers(file_path: str):
+# Submissions run on this many background threads; further uploads wait in the pool's queue
+SUBMIT_WORKERS = int(os.getenv("SUBMIT_WORKERS", "4"))
+# Finished jobs kept around for paging through their table
+MAX_JOBS = 64
+# Answers table: rows per page and characters of each answer shown in the preview
+PAGE_SIZE = 50
+PREVIEW_CHARS = 200
+# How often the UI polls a running job for progress (seconds)
+POLL_INTERVAL = 0.5
+
+TABLE_COLUMNS = ["task_id", "type", "submitted_answer"]
+
+
+def preview(text, limit: int = PREVIEW_CHARS) -> str:
+    text = str(text or "")
+    return text if len(text) <= limit else text[:limit] + " …"
+
+
+def iter_uploaded(file_path: str):
+    """Stream answer records from an uploaded output.json / .jsonl / columnar .jsonl.zst file."""
+    if is_columnar(file_path):
+        return iter_rows(file_path, ("task_id", "type", "submitted_answer"))
+    return iter_records(file_path)
+
+
+def preview_row(rec: dict) -> dict:
+    return {
+        "task_id": rec.get("task_id", ""),
+        "type": rec.get("type", ""),
+        "submitted_answer": preview(rec.get("submitted_answer", "")),
+    }
+
+
+class SubmissionJob:
+    """One uploaded file: parsed, submitted to the scoring API, and kept for paging its table."""
+    def __init__(self, file_path: str):
+        self.id = uuid.uuid4().hex
+        self.file_path = file_path
+        self.done = False
+        self.status = "Queued."
+        self.answer_count = 0
+        # preview rows go to a temp JSONL file while the upload is read; the table seeks to a page's offset
+        self.preview_path = None
+        self.page_offsets = []
+
+    def run(self):
+        try:
+            self._run()
+        except Exception as e:
+            self.status = f"Submission failed: {e}"
+        finally:
+            # the UI polls until done, so it must be set whatever happens
+            self.done = True
+
+    def _run(self):
+        # Parse the upload as a stream
+        answers = []
+        offsets = []
+        try:
+            with tempfile.NamedTemporaryFile("wb", prefix="submission-", suffix=".previews.jsonl",
+                                             delete=False) as previews:
+                self.preview_path = previews.name
+                for rec in iter_uploaded(self.file_path):
+                    if len(answers) % PAGE_SIZE == 0:
+                        offsets.append(previews.tell())
+                    previews.write((json.dumps(preview_row(rec), ensure_ascii=False) + "\n").encode("utf-8"))
+                    answers.append({"task_id": rec.get("task_id", ""), "submitted_answer": rec.get("submitted_answer", "")})
+                    if len(answers) % 1000 == 0:
+                        self.status = f"Reading answers: {len(answers)} so far…"
+        except Exception as e:
+            self.status = f"Failed to load answers: {e}"
+            return
+        self.answer_count = len(answers)
+        self.page_offsets = offsets
+
+        # Determine the username (from env or placeholder)
+        username = os.getenv("HF_USERNAME", "<cola_team>")
+
+        # Build payload for submission
+        payload = {
+            "username":   username,
+            "agent_code": f"https://huggingface.co/spaces/{os.getenv('SPACE_ID')}/tree/main",
+            "answers":    answers
+        }
+
+        # Send request to scoring API
+        self.status = f"Submitting {len(answers)} answers…"
+        try:
+            response = requests.post(API_SUBMIT_URL, json=payload, timeout=60)
+            response.raise_for_status()
+            data = response.json()
+        except Exception as e:
+            self.status = f"Submission failed: {e}"
+            return
+
+        # Format a user-friendly status message
+        self.status = (
+            f"Submission Successful!\n"
+            f"User: {data.get('username')}\n"
+            f"Score: {data.get('score','N/A')}% "
+            f"({data.get('correct_count','?')}/{data.get('total_attempted','?')})\n"
+            f"Message: {data.get('message','')}"
+        )
+
+    def page_count(self) -> int:
+        return max(1, -(-self.answer_count // PAGE_SIZE))
+
+    def page(self, number: int) -> pd.DataFrame:
+        """Preview rows of one page, read straight from its offset in the preview file."""
+        rows = []
+        if 1 <= number <= len(self.page_offsets):
+            with open(self.preview_path, "rb") as f:
+                f.seek(self.page_offsets[number - 1])
+                rows = [json.loads(line) for line in islice(f, PAGE_SIZE)]
+        return pd.DataFrame(rows, columns=TABLE_COLUMNS)
+
+    def discard(self):
+        """Delete the preview file once the job is forgotten."""
+        if self.preview_path and os.path.exists(self.preview_path):
+            os.remove(self.preview_path)
+
+
+submit_pool = ThreadPoolExecutor(max_workers=SUBMIT_WORKERS, thread_name_prefix="submit")
+jobs = OrderedDict()
+jobs_lock = threading.Lock()
+
+
+def start_job(file_path: str) -> SubmissionJob:
+    job = SubmissionJob(file_path)
+    with jobs_lock:
+        jobs[job.id] = job
+        # forget the oldest finished jobs
+        for old_id in [jid for jid, j in jobs.items() if j.done][:max(0, len(jobs) - MAX_JOBS)]:
+            jobs.pop(old_id).discard()
+    submit_pool.submit(job.run)
+    return job
+
+
+def render_page(job_id: str, number):
+    """Server-side page of the answers table: (page number, rows, 'Page x / y')."""
+    with jobs_lock:
+        job = jobs.get(job_id)
+    if job is None:
+        return 1, pd.DataFrame(columns=TABLE_COLUMNS), ""
+    number = min(max(1, int(number or 1)), job.page_count())
+    return number, job.page(number), f"Page {number} / {job.page_count()} ({job.answer_count} answers)"
+
+
+async def submit_existing_answers(file_path: str):
     """
-    Gradio callback: read the uploaded JSON file at file_path,
-    submit its contents to the scoring API, and return a status message
-    and a table of the answers.
+    Gradio callback: queue the uploaded file for submission and stream the job's progress.
+    Parsing and the scoring API call run on the submission pool, so no Gradio worker is blocked;
+    once the job finishes, the first page of the answers table is shown.
     """
-    # Load answers from the JSON file
-    try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            answers = json.load(f)
-    except Exception as e:
-        return f"Failed to load JSON: {e}", None
-
-    # Determine the username (from env or placeholder)
-    username = os.getenv("HF_USERNAME", "<cola_team>")
-
-    # Build payload for submission
-    payload = {
-        "username":   username,
-        "agent_code": f"https://huggingface.co/spaces/{os.getenv('SPACE_ID')}/tree/main",
-        "answers":    answers
-    }
+    if not file_path:
+        yield "Please upload a file first.", "", 1, None, ""
+        return
+    job = start_job(file_path)
+    while not job.done:
+        yield job.status, job.id, 1, None, ""
+        await asyncio.sleep(POLL_INTERVAL)
+    yield (job.status, job.id, *render_page(job.id, 1))
 
-    # Send request to scoring API
-    try:
-        response = requests.post(API_SUBMIT_URL, json=payload, timeout=60)
-        response.raise_for_status()
-        data = response.json()
-    except Exception as e:
-        return f"Submission failed: {e}", None
-
-    # Format a user-friendly status message
-    status = (
-        f"Submission Successful!\n"
-        f"User: {data.get('username')}\n"
-        f"Score: {data.get('score','N/A')}% "
-        f"({data.get('correct_count','?')}/{data.get('total_attempted','?')})\n"
-        f"Message: {data.get('message','')}"
-    )
 
-    # Return the status and a DataFrame of the submitted answers
-    return status, pd.DataFrame(answers)
+def previous_page(job_id, number):
+    return render_page(job_id, (number or 1) - 1)
+
+
+def next_page(job_id, number):
+    return render_page(job_id, (number or 1) + 1)
+
 
 # Build the Gradio interface
 with gr.Blocks() as demo:
     gr.Markdown("# Submit Pre-Generated Answers")
     gr.Markdown(
         """
-        Upload your `output.json` (the JSON array of `{task_id, submitted_answer}` objects),
+        Upload your `output.json` (the JSON array of `{task_id, submitted_answer}` objects)
+        or the columnar `output.jsonl.zst`,
         then click **Submit Uploaded Answers** to get your score.
         """
     )
 
     # File uploader for a single JSON file
-    upload     = gr.File(label="Upload output.json", file_types=[".json"])
+    upload     = gr.File(label="Upload output.json", file_types=[".json", ".jsonl", ".zst"])
     # Button to trigger submission
     submit_btn = gr.Button("Submit Uploaded Answers")
     # Textbox to display status
     status_out = gr.Textbox(label="Submission Status", lines=5, interactive=False)
-    # Table to display the answers
-    table_out  = gr.DataFrame(label="Answers Table")
+    # Id of the submission whose answers are shown
+    job_id     = gr.State("")
+    # Table to display one page of the answers (previews truncated)
+    table_out  = gr.DataFrame(label="Answers Table", headers=TABLE_COLUMNS)
+    with gr.Row():
+        prev_btn   = gr.Button("◀ Previous")
+        page_num   = gr.Number(value=1, label="Page", precision=0)
+        next_btn   = gr.Button("Next ▶")
+    page_label = gr.Markdown("")
 
-    # Wire up the callback: only the uploaded file is passed as input
+    # Wire up the callback: only the uploaded file is passed as input. The heavy lifting happens
+    # on the submission pool, so this event doesn't need a concurrency limit.
     submit_btn.click(
         fn=submit_existing_answers,
         inputs=[upload],
-        outputs=[status_out, table_out]
+        outputs=[status_out, job_id, page_num, table_out, page_label],
+        concurrency_limit=None,
     )
+    prev_btn.click(fn=previous_page, inputs=[job_id, page_num], outputs=[page_num, table_out, page_label])
+    next_btn.click(fn=next_page, inputs=[job_id, page_num], outputs=[page_num, table_out, page_label])
+    page_num.submit(fn=render_page, inputs=[job_id, page_num], outputs=[page_num, table_out, page_label])
 
 if __name__ == "__main__":
-    demo.launch(debug=True, share=False)
+    demo.queue().launch(debug=True, share=False)
@@ -0,0 +1,89 @@
+import threading
+import javalang
+from javalang.tree import Node
+
+
+def parse_java_snippet(code: str):
+    """Wrap the snippet in a minimal class and parse it; None if it doesn't parse."""
+    wrapped = f"public class Dummy {{\n{code}\n}}"
+    try:
+        return javalang.parse.parse(wrapped)
+    except Exception:
+        return None
+
+
+def child_nodes(node):
+    """Direct Node children, including Nodes held in list attributes (same walk as the evaluator always used)."""
+    for child in node.children:
+        if isinstance(child, Node):
+            yield child
+        elif isinstance(child, list):
+            for c in child:
+                if isinstance(c, Node):
+                    yield c
+
+
+class SubtreeFingerprinter:
+    """
+    Collects a (node_type, child_types) signature for every node of a javalang AST in a single
+    pass and interns each distinct signature to a small integer id, so AST overlap becomes an
+    intersection of int sets.
+
+    With child_types=False (the default) the signature is just the node type. That is exactly
+    what debug_evaluate has always scored: it built child_types with node.filter(lambda ...),
+    and javalang compares a non-type pattern with ==, so that tuple was always empty.
+    child_types=True includes the types of the direct children.
+    """
+    def __init__(self, child_types: bool = False):
+        self.child_types = child_types
+        self._lock = threading.Lock()
+        self._ids = {}
+        self._signatures = []
+
+    def _intern(self, signature) -> int:
+        sid = self._ids.get(signature)
+        if sid is None:
+            with self._lock:
+                sid = self._ids.get(signature)
+                if sid is None:
+                    sid = self._ids[signature] = len(self._signatures)
+                    self._signatures.append(signature)
+        return sid
+
+    def signature(self, sid: int) -> tuple:
+        return self._signatures[sid]
+
+    def fingerprint_tree(self, tree) -> frozenset:
+        ids = set()
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            children = list(child_nodes(node))
+            if self.child_types:
+                kids = tuple(type(c).__name__ for c in children)
+            else:
+                kids = ()
+            ids.add(self._intern((type(node).__name__, kids)))
+            stack.extend(children)
+        return frozenset(ids)
+
+    def fingerprint(self, code: str) -> frozenset:
+        """Interned signature ids of a Java snippet (empty on a parse error)."""
+        tree = parse_java_snippet(code)
+        if tree is None:
+            return frozenset()
+        return self.fingerprint_tree(tree)
+
+    def signatures(self, code: str) -> set:
+        return {self.signature(sid) for sid in self.fingerprint(code)}
+
+    def ids(self, signatures) -> frozenset:
+        """Intern signatures computed elsewhere (another process, an on-disk cache) into this engine's ids."""
+        return frozenset(self._intern((name, tuple(kids))) for name, kids in signatures)
+
+
+def overlap_score(pred_ids: frozenset, ref_ids: frozenset) -> float:
+    """|pred ∩ ref| / |ref|, 0.0 when the reference has no signatures."""
+    if not ref_ids:
+        return 0.0
+    return len(pred_ids & ref_ids) / len(ref_ids)
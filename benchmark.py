@@ -0,0 +1,259 @@
+"""
+Offline throughput / latency benchmark for the batch pipeline.
+
+Starts local stand-ins for Ollama and Groq (fake_llm_servers.py), builds a synthetic dataset
+and a small local vector index, then runs the real main.py against them in a child process.
+Reports tasks/sec, p50/p95/p99 per-task latency, peak RSS and startup time, and saves them as
+JSON so two commits can be compared:
+
+  python benchmark.py --tasks 200 --label before
+  python benchmark.py --tasks 200 --label after --compare bench_results/before.json
+"""
+import os
+import sys
+import json
+import time
+import runpy
+import shutil
+import argparse
+import tempfile
+import subprocess
+from fake_llm_servers import FakeGroq, FakeOllama
+from columnar_output import columnar_path_for, iter_rows
+
+RESULTS_DIR = "bench_results"
+EMBEDDING_DIM = 768
+
+
+def build_dataset(path: str, n_tasks: int, causal_ratio: float):
+    """Cycle the repair and causal datasets into n_tasks entries with unique task_ids."""
+    with open("bug_data/debug_dataset.jsonl", encoding="utf-8") as f:
+        repair = [json.loads(line) for line in f if line.strip()]
+    with open("student_data/questions.json", encoding="utf-8") as f:
+        causal = json.load(f)
+    n_causal = round(n_tasks * causal_ratio)
+    with open(path, "w", encoding="utf-8") as out:
+        for i in range(n_tasks):
+            # spread causal tasks evenly through the run
+            is_causal = (i * n_causal) // n_tasks != ((i + 1) * n_causal) // n_tasks
+            src = causal[i % len(causal)] if is_causal else repair[i % len(repair)]
+            out.write(json.dumps({**src, "task_id": f"bench-{i:06d}"}, ensure_ascii=False) + "\n")
+
+
+def fake_embeddings():
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    return DeterministicFakeEmbedding(size=EMBEDDING_DIM)
+
+
+def build_fake_index(directory: str):
+    """Local index over the causal questions, embedded with deterministic fake vectors."""
+    from local_index import write_index
+    with open("student_data/questions.json", encoding="utf-8") as f:
+        questions = [q["question"] for q in json.load(f)]
+    records = [
+        {"id": i, "content": f"Question : {q}\n\nFinal answer : 42", "metadata": {}}
+        for i, q in enumerate(questions)
+    ]
+    write_index(directory, fake_embeddings().embed_documents(questions), records)
+
+
+def run_child(main_args: list[str], real_embeddings: bool):
+    """Entry point of the benchmark child process: run main.py in-process with the offline patches."""
+    if not real_embeddings:
+        import causal_analyzer
+        embeddings = fake_embeddings()
+        causal_analyzer.get_embeddings = lambda: embeddings
+    sys.argv = ["main.py"] + main_args
+    runpy.run_path("main.py", run_name="__main__")
+
+
+def measure_startup(env: dict, repeats: int = 3) -> float:
+    """Best-of-N wall time for a fresh interpreter to import the batch entry points."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import main, repair_engine"], env=env, check=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def run_benchmark(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    ollama = FakeOllama(args.ollama_latency, args.ollama_tps, explanation_tokens=args.explanation_tokens).start()
+    groq = FakeGroq(args.groq_latency, args.groq_tps, tool_rounds=args.tool_rounds,
+                    tools_per_turn=args.tools_per_turn).start()
+    try:
+        dataset = os.path.join(workdir, "dataset.jsonl")
+        output = os.path.join(workdir, "output.json")
+        build_dataset(dataset, args.tasks, args.causal_ratio)
+        build_fake_index(os.path.join(workdir, "index"))
+
+        env = dict(
+            os.environ,
+            OLLAMA_API_BASE=ollama.url,
+            GROQ_API_BASE=groq.url,
+            GROQ_API_KEY="bench",
+            VECTOR_BACKEND="local",
+            LOCAL_INDEX_DIR=os.path.join(workdir, "index"),
+            TOOL_CACHE_MODE="replay",
+            TOOL_CACHE_PATH=os.path.join(workdir, "tool_cache.sqlite"),
+            REPAIR_CACHE_BYPASS="1",
+            SEMANTIC_CACHE_PATH=os.path.join(workdir, "semantic_answers.npz"),
+        )
+        startup = measure_startup(env)
+
+        child = [sys.executable, os.path.abspath(__file__), "--child"]
+        if args.real_embeddings:
+            child.append("--real-embeddings")
+        child += ["--", "--input", dataset, "--output", output,
+                  "--repair-workers", str(args.repair_workers),
+                  "--causal-workers", str(args.causal_workers)] + args.main_args
+        log_path = os.path.join(workdir, "main.log")
+        start = time.perf_counter()
+        with open(log_path, "w") as log:
+            proc = subprocess.Popen(child, env=env, stdout=log, stderr=subprocess.STDOUT)
+            _, status, rusage = os.wait4(proc.pid, 0)
+        wall = time.perf_counter() - start
+        if os.waitstatus_to_exitcode(status) != 0:
+            with open(log_path) as log:
+                sys.stderr.write(log.read()[-4000:])
+            raise SystemExit("benchmark run failed")
+
+        latencies, errors = [], 0
+        for row in iter_rows(columnar_path_for(output), ("latency_s", "submitted_answer")):
+            latencies.append(row["latency_s"] or 0.0)
+            errors += str(row["submitted_answer"] or "").startswith("AGENT ERROR:")
+
+        return {
+            "label": args.label,
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": {
+                "tasks": args.tasks,
+                "causal_ratio": args.causal_ratio,
+                "repair_workers": args.repair_workers,
+                "causal_workers": args.causal_workers,
+                "ollama_latency": args.ollama_latency,
+                "ollama_tps": args.ollama_tps,
+                "groq_latency": args.groq_latency,
+                "groq_tps": args.groq_tps,
+                "tool_rounds": args.tool_rounds,
+                "tools_per_turn": args.tools_per_turn,
+                "main_args": args.main_args,
+            },
+            "metrics": {
+                "tasks_per_sec": round(len(latencies) / wall, 3) if wall else 0.0,
+                "wall_s": round(wall, 3),
+                "p50_s": round(percentile(latencies, 50), 4),
+                "p95_s": round(percentile(latencies, 95), 4),
+                "p99_s": round(percentile(latencies, 99), 4),
+                "peak_rss_mb": round(rusage.ru_maxrss / 1024, 1),  # ru_maxrss is KiB on Linux
+                "startup_s": round(startup, 3),
+                "errors": errors,
+                "ollama_requests": ollama.requests,
+                "groq_requests": groq.requests,
+            },
+        }
+    finally:
+        ollama.stop()
+        groq.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# metric -> True if higher is better
+TRACKED = {
+    "tasks_per_sec": True,
+    "p50_s": False,
+    "p95_s": False,
+    "p99_s": False,
+    "peak_rss_mb": False,
+    "startup_s": False,
+}
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Print metric deltas against a saved baseline; return the metrics that regressed past tolerance."""
+    regressions = []
+    for name, higher_is_better in TRACKED.items():
+        new, old = result["metrics"].get(name), baseline["metrics"].get(name)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        flag = "  REGRESSION" if worse > tolerance else ""
+        print(f"  {name:<14} {old:>10} -> {new:<10} ({change:+.1%}){flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline benchmark of main.py against fake LLM servers.")
+    parser.add_argument("--tasks", type=int, default=100)
+    parser.add_argument("--causal-ratio", type=float, default=0.5, help="fraction of causal (non-repair) tasks")
+    parser.add_argument("--repair-workers", type=int, default=4)
+    parser.add_argument("--causal-workers", type=int, default=4)
+    parser.add_argument("--ollama-latency", default="lognormal:0.3,0.4",
+                        help="time to first token: fixed:S | uniform:LO,HI | lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--ollama-tps", type=float, default=400.0, help="fake Ollama tokens/sec")
+    parser.add_argument("--explanation-tokens", type=int, default=120,
+                        help="length of the explanation the fake Ollama appends after the code")
+    parser.add_argument("--groq-latency", default="lognormal:0.2,0.3")
+    parser.add_argument("--groq-tps", type=float, default=800.0)
+    parser.add_argument("--tool-rounds", type=int, default=1, help="assistant turns with tool calls per question")
+    parser.add_argument("--tools-per-turn", type=int, default=1, help="tool calls the fake Groq issues in one turn")
+    parser.add_argument("--real-embeddings", action="store_true",
+                        help="use the real mpnet model instead of deterministic fake embeddings")
+    parser.add_argument("--label", default="run")
+    parser.add_argument("--out", default=None, help=f"result file (default: {RESULTS_DIR}/<label>.json)")
+    parser.add_argument("--compare", default=None, help="baseline result JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative regression")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("main_args", nargs="*", help="extra arguments passed through to main.py (after --)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.child:
+        run_child(args.main_args, args.real_embeddings)
+        return
+
+    result = run_benchmark(args)
+    out = args.out or os.path.join(RESULTS_DIR, f"{args.label}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+
+    print(f"Benchmark '{args.label}' ({args.tasks} tasks):")
+    for name, value in result["metrics"].items():
+        print(f"  {name:<16} {value}")
+    print(f"Results saved to {out}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"Compared with {args.compare} ({baseline.get('commit', '?')}):")
+        if compare(result, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,31 @@
 import os
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from dotenv import load_dotenv
 from langgraph.graph import START, StateGraph, MessagesState
 from langgraph.prebuilt import tools_condition
-from langgraph.prebuilt import ToolNode
-from langchain_groq import ChatGroq
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.tools.tavily_search import TavilySearchResults
-from langchain_community.document_loaders import WikipediaLoader
-from langchain_community.document_loaders import ArxivLoader
-from langchain_community.vectorstores import SupabaseVectorStore
-from langchain_core.messages import SystemMessage, HumanMessage
+from langchain_core.messages import SystemMessage, HumanMessage, ToolMessage
 from langchain_core.tools import tool
-from langchain.tools.retriever import create_retriever_tool
-from supabase.client import Client, create_client
+from tool_cache import cached_tool
+from startup import lazy_resource
+from instrumentation import current_task, in_task_thread, instrument_node, recorder
+from context_compaction import compact_messages, estimate_tokens
+from speculative_tools import Speculation, discard_speculations, match_speculation, speculative_queries
 import warnings
 warnings.filterwarnings("ignore")
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
 load_dotenv()
 
 @tool
+@cached_tool("wiki_search")
 def wiki_search(input: str) -> str:
     """Search Wikipedia for a query and return maximum 2 results.
 
     Args:
         input: The search query."""
+    from langchain_community.document_loaders import WikipediaLoader
     search_docs = WikipediaLoader(query=input, load_max_docs=2).load()
     formatted_search_docs = "\n\n---\n\n".join(
         [
@@ -33,11 +35,13 @@ def wiki_search(input: str) -> str:
     return formatted_search_docs
 
 @tool
+@cached_tool("web_search")
 def web_search(input: str) -> str:
     """Search Tavily for a query and return maximum 2 results.
 
     Args:
         input: The search query."""
+    from langchain_community.tools.tavily_search import TavilySearchResults
     search_docs = TavilySearchResults(max_results=2).invoke(query=input)
     formatted_search_docs = "\n\n---\n\n".join(
         [
@@ -47,11 +51,13 @@ def web_search(input: str) -> str:
     return formatted_search_docs
 
 @tool
+@cached_tool("arvix_search")
 def arvix_search(input: str) -> str:
     """Search Arxiv for a query and return maximum 2 result.
 
     Args:
         input: The search query."""
+    from langchain_community.document_loaders import ArxivLoader
     search_docs = ArxivLoader(query=input, load_max_docs=2).load()
     formatted_search_docs = "\n\n---\n\n".join(
         [
@@ -62,30 +68,102 @@ def arvix_search(input: str) -> str:
 
 
 
-# load the system prompt from the file
-with open("system_prompt.txt", "r", encoding="utf-8") as f:
-    system_prompt = f.read()
+# Heavy resources (the 420 MB embedding model, the Supabase client, the prompt file) are only
+# created on first use, so importing this module stays cheap for code_repair-only runs.
+
+@lazy_resource("system prompt")
+def get_system_message() -> SystemMessage:
+    # load the system prompt from the file
+    with open("system_prompt.txt", "r", encoding="utf-8") as f:
+        return SystemMessage(content=f.read())
+
+@lazy_resource("embedding model")
+def get_embeddings():
+    # EMBEDDING_SERVER=unix:/path or host:port uses the shared server (embedding_server.py) instead of a local copy
+    if os.environ.get("EMBEDDING_SERVER"):
+        from embedding_server import EmbeddingClient
+        return EmbeddingClient(os.environ["EMBEDDING_SERVER"])
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2") #  dim=768
+
+@lazy_resource("vector store")
+def get_vector_store():
+    # VECTOR_BACKEND=local serves retrieval from a memory-mapped index built by local_index.py
+    if os.environ.get("VECTOR_BACKEND", "supabase") == "local":
+        from local_index import LocalVectorIndex
+        return LocalVectorIndex(os.environ.get("LOCAL_INDEX_DIR", "index"), get_embeddings())
+
+    from supabase.client import create_client
+    from langchain_community.vectorstores import SupabaseVectorStore
+    supabase = create_client(
+        os.environ.get("SUPABASE_URL"),
+        os.environ.get("SUPABASE_SERVICE_KEY"))
+    return SupabaseVectorStore(
+        client=supabase,
+        embedding=get_embeddings(),
+        table_name="documents",
+        query_name="match_documents_langchain",
+    )
+
+@lazy_resource("retriever tool")
+def get_retriever_tool():
+    from langchain.tools.retriever import create_retriever_tool
+    return create_retriever_tool(
+        retriever=get_vector_store().as_retriever(),
+        name="Question Search",
+        description="A tool to retrieve similar questions from a vector store.",
+    )
 
-# System message
-sys_msg = SystemMessage(content=system_prompt)
 
-# build a retriever
-embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2") #  dim=768
-supabase: Client = create_client(
-    os.environ.get("SUPABASE_URL"),
-    os.environ.get("SUPABASE_SERVICE_KEY"))
-vector_store = SupabaseVectorStore(
-    client=supabase,
-    embedding= embeddings,
-    table_name="documents",
-    query_name="match_documents_langchain",
-)
-create_retriever_tool = create_retriever_tool(
-    retriever=vector_store.as_retriever(),
-    name="Question Search",
-    description="A tool to retrieve similar questions from a vector store.",
-)
 
+def embed_questions(questions: list[str], batch_size: int = 32) -> list[list[float]]:
+    """Embed questions with batched embed_documents calls."""
+    embeddings = get_embeddings()
+    vectors = []
+    for start in range(0, len(questions), batch_size):
+        vectors.extend(embeddings.embed_documents(questions[start:start + batch_size]))
+    return vectors
+
+
+def search_similar(questions: list[str], batch_size: int = 32, k: int = 1, vectors=None) -> list[list]:
+    """
+    Embed many questions with batched embed_documents calls and look up their neighbours in bulk,
+    so the retriever node can skip its own per-question embedding (see AgentState.similar_docs).
+    Pass `vectors` from embed_questions() to skip the embedding step.
+    """
+    if vectors is None:
+        vectors = embed_questions(questions, batch_size)
+    store = get_vector_store()
+    results = []
+    for start in range(0, len(vectors), batch_size):
+        batch = vectors[start:start + batch_size]
+        if hasattr(store, "search_vectors"):
+            # local index: one matrix product for the whole batch
+            results.extend(store.search_vectors(batch, k))
+        else:
+            # Supabase: one RPC per vector, issued concurrently
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                results.extend(pool.map(lambda v: store.similarity_search_by_vector(v, k=k), batch))
+    return results
+
+
+# Semantic answer cache in front of the graph: a paraphrase of an answered question
+# (cosine >= SEMANTIC_CACHE_THRESHOLD on the mpnet embeddings) reuses the stored FINAL ANSWER.
+SEMANTIC_CACHE_PATH = os.environ.get("SEMANTIC_CACHE_PATH", ".cache/semantic_answers.npz")
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_SIZE = int(os.environ.get("SEMANTIC_CACHE_SIZE", "10000"))
+
+@lazy_resource("semantic answer cache")
+def get_answer_cache():
+    from semantic_cache import SemanticAnswerCache
+    return SemanticAnswerCache(SEMANTIC_CACHE_PATH, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_SIZE)
+
+
+class AgentState(MessagesState):
+    # neighbours precomputed by search_similar(); when present the retriever doesn't re-embed
+    similar_docs: list
+    # speculative tool prefetches started by the retriever (see SPECULATIVE_TOOLS)
+    speculation: list
 
 
 tools = [
@@ -93,10 +171,120 @@ tools = [
     web_search,
     arvix_search,
 ]
+tools_by_name = {t.name: t for t in tools}
+
+# Seconds a single tool call may take before its result is replaced by an error message:
+# TOOL_TIMEOUT for every tool, overridden per tool by e.g. TOOL_TIMEOUT_WEB_SEARCH
+DEFAULT_TOOL_TIMEOUT = float(os.environ.get("TOOL_TIMEOUT", "30"))
+TOOL_TIMEOUTS = {
+    name: float(os.environ.get(f"TOOL_TIMEOUT_{name.upper()}", DEFAULT_TOOL_TIMEOUT))
+    for name in tools_by_name
+}
+
+@lazy_resource("tool executor")
+def get_tool_executor() -> ThreadPoolExecutor:
+    # shared by every task, so TOOL_MAX_CONCURRENCY caps tool calls across the whole process
+    return ThreadPoolExecutor(
+        max_workers=int(os.environ.get("TOOL_MAX_CONCURRENCY", "8")),
+        thread_name_prefix="tool",
+    )
+
+# Speculative prefetch: comma-separated tools to query in the background, with queries derived from the
+# question, while the first assistant call is in flight (empty = off). A tool call whose query shares at
+# least SPECULATIVE_MATCH of its keywords (Jaccard) with a prefetched query reuses that result.
+SPECULATIVE_TOOLS = [name.strip() for name in os.environ.get("SPECULATIVE_TOOLS", "").split(",")
+                     if name.strip() in tools_by_name]
+SPECULATIVE_MATCH = float(os.environ.get("SPECULATIVE_MATCH", "0.6"))
+
+@lazy_resource("speculation executor")
+def get_speculation_executor() -> ThreadPoolExecutor:
+    # prefetches get their own, smaller pool so they never queue ahead of real tool calls
+    return ThreadPoolExecutor(
+        max_workers=int(os.environ.get("SPECULATIVE_MAX_CONCURRENCY", "2")),
+        thread_name_prefix="speculate",
+    )
+
+# task_id -> its prefetches, so they can be discarded even when the graph raises mid-run
+_task_speculations = {}
+_task_speculations_lock = threading.Lock()
+
+def submit_tool_call(name: str, args: dict, executor: ThreadPoolExecutor = None):
+    ctx = contextvars.copy_context()
+    return (executor or get_tool_executor()).submit(ctx.run, in_task_thread, tools_by_name[name].invoke, args)
+
+def start_speculation(question: str, example: str) -> list[Speculation]:
+    speculations = [
+        Speculation(name, query, submit_tool_call(name, {"input": query}, get_speculation_executor()))
+        for name in SPECULATIVE_TOOLS
+        for query in speculative_queries(question, example)
+    ]
+    with _task_speculations_lock:
+        _task_speculations[current_task.get()] = speculations
+    recorder.record_speculation("started", len(speculations))
+    return speculations
+
+def discard_task_speculations() -> int:
+    """Cancel the current task's unused prefetches and record how many were dropped."""
+    with _task_speculations_lock:
+        speculations = _task_speculations.pop(current_task.get(), [])
+    discarded = discard_speculations(speculations)
+    recorder.record_speculation("discarded", discarded)
+    return discarded
+
+def run_tool_calls(tool_calls: list[dict], speculations=()) -> list[ToolMessage]:
+    """
+    Run all tool calls of one assistant turn concurrently and return their ToolMessages
+    in the order the model issued the calls. A call that fails or overruns its timeout
+    gets an error message instead, so the assistant can still answer. A call matching
+    one of `speculations` takes the prefetched result if that prefetch has already started.
+    """
+    pending = []
+    for call in tool_calls:
+        if call["name"] not in tools_by_name:
+            pending.append((call, None, 0.0))
+            continue
+        deadline = time.monotonic() + TOOL_TIMEOUTS.get(call["name"], DEFAULT_TOOL_TIMEOUT)
+        spec = match_speculation(speculations, call["name"], str(call["args"].get("input", "")), SPECULATIVE_MATCH)
+        if spec is not None and spec.future.cancel():
+            # the prefetch is still queued behind other tasks' prefetches: a fresh call is faster
+            recorder.record_speculation("discarded")
+            spec = None
+        if spec is not None:
+            recorder.record_speculation("hit")
+            future = spec.future
+        else:
+            future = submit_tool_call(call["name"], call["args"])
+        pending.append((call, future, deadline))
+
+    messages = []
+    for call, future, deadline in pending:
+        if future is None:
+            content = f"Error: unknown tool {call['name']!r}"
+        else:
+            try:
+                content = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                future.cancel()
+                content = f"Error: {call['name']} timed out"
+            except Exception as e:
+                content = f"Error: {call['name']} failed: {e}"
+        messages.append(ToolMessage(content=str(content), name=call["name"], tool_call_id=call["id"]))
+    return messages
+
+# Prompt budget for every assistant call (older tool outputs are clipped to fit)
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "6000"))
+# Assistant <-> tools round trips allowed before the model must answer without tools
+MAX_TOOL_ROUNDS = int(os.environ.get("MAX_TOOL_ROUNDS", "5"))
+
+FORCE_ANSWER_PROMPT = (
+    "You have used all available tool calls. Answer now from the information above, "
+    "using the required FINAL ANSWER format."
+)
 
 # Build graph function
 def build_graph(provider: str = "groq"):
     """Build the graph"""
+    from langchain_groq import ChatGroq
     # Load environment variables from .env file
     llm = ChatGroq(model="qwen/qwen3-32b", temperature=0,)
 
@@ -104,29 +292,69 @@ def build_graph(provider: str = "groq"):
     llm_with_tools = llm.bind_tools(tools)
 
     # Node
-    def assistant(state: MessagesState):
+    @instrument_node("assistant")
+    def assistant(state: AgentState):
         """Assistant node"""
-        return {"messages": [llm_with_tools.invoke(state["messages"])]}
+        rounds = sum(1 for m in state["messages"] if getattr(m, "tool_calls", None))
+        if rounds >= MAX_TOOL_ROUNDS:
+            # hard cap on the tool loop: ask once more without tools so the run ends here
+            response = llm.invoke(state["messages"] + [HumanMessage(content=FORCE_ANSWER_PROMPT)])
+        else:
+            response = llm_with_tools.invoke(state["messages"])
+        if state.get("speculation") and not response.tool_calls:
+            # answered without tools: the prefetches are stale
+            discard_task_speculations()
+            return {"messages": [response], "speculation": []}
+        return {"messages": [response]}
 
-    def retriever(state: MessagesState):
+    @instrument_node("retriever")
+    def retriever(state: AgentState):
         """Retriever node"""
-        similar_question = vector_store.similarity_search(state["messages"][0].content)
+        similar_question = state.get("similar_docs") or get_vector_store().similarity_search(state["messages"][0].content)
         example_msg = HumanMessage(
             content=f"Here I provide a similar question and answer for reference: \n\n{similar_question[0].page_content}",
         )
-        return {"messages": [sys_msg] + state["messages"] + [example_msg]}
+        update = {"messages": [get_system_message()] + state["messages"] + [example_msg]}
+        if SPECULATIVE_TOOLS:
+            # overlap likely searches with the first assistant call
+            update["speculation"] = start_speculation(state["messages"][0].content, similar_question[0].page_content)
+        return update
+
+    @instrument_node("tools")
+    def run_tools(state: AgentState):
+        """Tools node"""
+        tool_calls = state["messages"][-1].tool_calls
+        recorder.record_tools(call["name"] for call in tool_calls)
+        recorder.record_loop()
+        speculations = state.get("speculation") or []
+        messages = run_tool_calls(tool_calls, speculations)
+        if not speculations:
+            return {"messages": messages}
+        # prefetches only target the first tool round
+        discard_task_speculations()
+        return {"messages": messages, "speculation": []}
+
+    @instrument_node("compact")
+    def compact(state: AgentState):
+        """Clip older tool outputs so the next assistant call stays under CONTEXT_TOKEN_BUDGET"""
+        question = next((m.content for m in state["messages"] if isinstance(m, HumanMessage)), "")
+        # leave room for FORCE_ANSWER_PROMPT in case this is the last round
+        budget = CONTEXT_TOKEN_BUDGET - estimate_tokens([HumanMessage(content=FORCE_ANSWER_PROMPT)]) - 1
+        return {"messages": compact_messages(state["messages"], question, budget)}
 
-    builder = StateGraph(MessagesState)
+    builder = StateGraph(AgentState)
     builder.add_node("retriever", retriever)
     builder.add_node("assistant", assistant)
-    builder.add_node("tools", ToolNode(tools))
+    builder.add_node("tools", run_tools)
+    builder.add_node("compact", compact)
     builder.add_edge(START, "retriever")
     builder.add_edge("retriever", "assistant")
     builder.add_conditional_edges(
         "assistant",
         tools_condition,
     )
-    builder.add_edge("tools", "assistant")
+    builder.add_edge("tools", "compact")
+    builder.add_edge("compact", "assistant")
 
     # Compile graph
     return builder.compile()
\ No newline at end of file
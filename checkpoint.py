@@ -0,0 +1,148 @@
+import os
+import json
+import threading
+
+# How often the checkpoint is forced to disk:
+#   always - fsync after every record (safest, slowest)
+#   batch  - fsync every `fsync_every` records and on close
+#   never  - leave it to the OS (records are still flushed per line)
+FSYNC_POLICIES = ("always", "batch", "never")
+
+
+def checkpoint_path_for(output_path: str) -> str:
+    """output.json -> output.checkpoint.jsonl"""
+    return os.path.splitext(output_path)[0] + ".checkpoint.jsonl"
+
+
+def retired_path_for(checkpoint_path: str) -> str:
+    """output.checkpoint.jsonl -> output.checkpoint.done.jsonl"""
+    root, ext = os.path.splitext(checkpoint_path)
+    return f"{root}.done{ext}"
+
+
+def retire(checkpoint_path: str) -> str:
+    """
+    Move a finished run's checkpoint out of the way so the next run starts fresh instead of
+    silently reusing its answers. Moving the file back resumes from it explicitly.
+    """
+    done_path = retired_path_for(checkpoint_path)
+    os.replace(checkpoint_path, done_path)
+    return done_path
+
+
+def iter_offsets(path: str):
+    """Yield (offset, record) for every complete line; a torn last line from a crash is skipped."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        offset = 0
+        for line in f:
+            start, offset = offset, offset + len(line)
+            if not line.endswith(b"\n"):
+                break
+            try:
+                yield start, json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def load_completed(path: str) -> set:
+    """task_ids that already have a successful answer in the checkpoint."""
+    return {
+        rec.get("task_id", "")
+        for _, rec in iter_offsets(path)
+        if not rec.get("error")
+    }
+
+
+class CheckpointWriter:
+    """Append one JSON line per finished task; safe to call from several worker threads."""
+    def __init__(self, path: str, fsync: str = "batch", fsync_every: int = 20):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync policy must be one of {FSYNC_POLICIES}, got {fsync!r}")
+        self.path = path
+        self.fsync = fsync
+        self.fsync_every = max(1, fsync_every)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._truncate_torn_tail()
+        self._f = open(path, "a", encoding="utf-8")
+
+    def _truncate_torn_tail(self):
+        # drop a half-written last line so new records start on a fresh line
+        if not os.path.exists(self.path):
+            return
+        last = None
+        for offset, _ in iter_offsets(self.path):
+            last = offset
+        with open(self.path, "rb+") as f:
+            # keep everything up to the end of the last complete record; with none (a crash during
+            # the very first write) the whole file is torn
+            end = 0
+            if last is not None:
+                f.seek(last)
+                f.readline()
+                end = f.tell()
+            f.truncate(end)
+
+    def write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._f.write(line)
+            self._f.flush()
+            self._pending += 1
+            if self.fsync == "always" or (self.fsync == "batch" and self._pending >= self.fsync_every):
+                os.fsync(self._f.fileno())
+                self._pending = 0
+
+    def close(self):
+        with self._lock:
+            self._f.flush()
+            if self.fsync != "never":
+                os.fsync(self._f.fileno())
+            self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_final_records(checkpoint_path: str, task_ids):
+    """
+    Yield the latest checkpoint record of each task in `task_ids` order, so a successful retry
+    replaces an earlier error. Only byte offsets are kept in memory; records are re-read as needed.
+    """
+    offsets = {}
+    for offset, rec in iter_offsets(checkpoint_path):
+        offsets[rec.get("task_id", "")] = offset
+    if not offsets:
+        return
+    with open(checkpoint_path, "rb") as src:
+        for tid in task_ids:
+            if tid not in offsets:
+                continue
+            src.seek(offsets.pop(tid))
+            yield json.loads(src.readline())
+
+
+def write_answers(records, output_path: str) -> int:
+    """Stream {task_id, submitted_answer} objects into the JSON array that app.py and debug_evaluate.py expect."""
+    written = 0
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as out:
+        out.write("[")
+        for rec in records:
+            answer = {"task_id": rec.get("task_id", ""), "submitted_answer": rec.get("submitted_answer", "")}
+            out.write(",\n  " if written else "\n  ")
+            out.write(json.dumps(answer, ensure_ascii=False))
+            written += 1
+        out.write("\n]\n" if written else "]\n")
+    os.replace(tmp_path, output_path)
+    return written
+
+
+def finalize(checkpoint_path: str, output_path: str, task_ids) -> int:
+    """Build output.json from the checkpoint, in input task order."""
+    return write_answers(iter_final_records(checkpoint_path, task_ids), output_path)
@@ -0,0 +1,102 @@
+"""
+Columnar result file: zstd-compressed JSONL with one fixed-schema row per task.
+
+  task_id, type, submitted_answer, code, explanation, latency_s, prompt_tokens, completion_tokens
+
+`code` / `explanation` are split out of repair answers when they are generated, so readers
+(debug_evaluate.py, app.py) can take the columns they need without re-parsing prose.
+Both the writer and iter_rows() stream; neither holds the file in memory.
+
+Export to the classic output.json:
+  python columnar_output.py export output.jsonl.zst output.json
+"""
+import io
+import os
+import json
+import argparse
+import zstandard
+from checkpoint import write_answers
+
+COLUMNS = (
+    "task_id", "type", "submitted_answer", "code", "explanation",
+    "latency_s", "prompt_tokens", "completion_tokens",
+)
+_DEFAULTS = {"latency_s": 0.0, "prompt_tokens": 0, "completion_tokens": 0}
+
+
+def columnar_path_for(output_path: str) -> str:
+    """output.json -> output.jsonl.zst"""
+    return os.path.splitext(output_path)[0] + ".jsonl.zst"
+
+
+def is_columnar(path: str) -> bool:
+    return str(path).endswith(".zst")
+
+
+def to_row(record: dict) -> dict:
+    return {col: record.get(col, _DEFAULTS.get(col, "")) for col in COLUMNS}
+
+
+class ColumnarWriter:
+    """Write rows to a temp file and move it into place on close."""
+    def __init__(self, path: str, level: int = 10):
+        self.path = path
+        self.written = 0
+        self._tmp = path + ".tmp"
+        self._file = open(self._tmp, "wb")
+        self._stream = zstandard.ZstdCompressor(level=level).stream_writer(self._file)
+
+    def write(self, record: dict):
+        self._stream.write((json.dumps(to_row(record), ensure_ascii=False) + "\n").encode("utf-8"))
+        self.written += 1
+
+    def close(self):
+        self._stream.flush(zstandard.FLUSH_FRAME)
+        self._file.close()
+        os.replace(self._tmp, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_columnar(records, path: str) -> int:
+    with ColumnarWriter(path) as writer:
+        for rec in records:
+            writer.write(rec)
+    return writer.written
+
+
+def iter_rows(path: str, columns=None):
+    """Yield rows (optionally only `columns`) one at a time."""
+    with open(path, "rb") as f:
+        reader = io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(f), encoding="utf-8")
+        for line in reader:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            yield {col: row.get(col) for col in columns} if columns else row
+
+
+def export_json(path: str, output_path: str) -> int:
+    """Compatibility export: columnar file -> output.json ([{task_id, submitted_answer}, ...])."""
+    return write_answers(iter_rows(path, ("task_id", "submitted_answer")), output_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tools for columnar (.jsonl.zst) result files.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="write the classic output.json from a columnar file")
+    export.add_argument("source")
+    export.add_argument("output", nargs="?", default="output.json")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        written = export_json(args.source, args.output)
+        print(f"Exported {written} answers to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import re
+from langchain_core.messages import ToolMessage
+from instrumentation import CHARS_PER_TOKEN
+
+# never clip a tool output below this many characters
+MIN_TOOL_CHARS = 400
+CLIP_NOTE = "\n[... clipped to fit the context budget]"
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n+")
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {
+    "the", "a", "an", "of", "in", "on", "and", "or", "to", "is", "are", "was", "were", "what",
+    "which", "who", "how", "many", "for", "by", "with", "that", "this", "it", "as", "at", "be",
+    "from", "did", "does", "do", "you", "can", "use", "version",
+}
+
+
+def estimate_tokens(messages) -> int:
+    return sum(len(str(m.content)) for m in messages) // CHARS_PER_TOKEN
+
+
+def keywords(text: str) -> set:
+    return {w for w in _WORD.findall(text.lower()) if w not in _STOPWORDS and len(w) > 2}
+
+
+def clip_extractive(text: str, terms: set, max_chars: int) -> str:
+    """
+    Shrink a tool output to about max_chars by keeping the sentences that mention the most
+    question terms (<Document ...> headers first), in their original order.
+    """
+    if len(text) <= max_chars:
+        return text
+    max_chars -= len(CLIP_NOTE)
+    pieces = [p.strip() for p in _SENTENCE_SPLIT.split(text) if p.strip()]
+    ranked = sorted(
+        range(len(pieces)),
+        key=lambda i: (
+            not pieces[i].startswith(("<Document", "</Document")),
+            -len(terms & keywords(pieces[i])),
+            i,
+        ),
+    )
+    keep, used = set(), 0
+    for i in ranked:
+        cost = len(pieces[i]) + 1
+        if used + cost > max_chars:
+            continue
+        keep.add(i)
+        used += cost
+    return "\n".join(pieces[i] for i in sorted(keep)) + CLIP_NOTE
+
+
+def compact_messages(messages, question: str, budget_tokens: int) -> list:
+    """
+    Return replacement ToolMessages (same ids) so the conversation fits budget_tokens.
+    System prompt, question, retrieved example and assistant turns are never touched;
+    tool outputs are clipped oldest first.
+    """
+    excess = (estimate_tokens(messages) - budget_tokens) * CHARS_PER_TOKEN
+    if excess <= 0:
+        return []
+    terms = keywords(question)
+    replaced = []
+    for msg in messages:
+        if not isinstance(msg, ToolMessage):
+            continue
+        content = str(msg.content)
+        target = max(MIN_TOOL_CHARS, len(content) - excess)
+        if target >= len(content):
+            continue
+        clipped = clip_extractive(content, terms, target)
+        excess -= len(content) - len(clipped)
+        replaced.append(msg.model_copy(update={"content": clipped}))
+        if excess <= 0:
+            break
+    return replaced
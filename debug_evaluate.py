@@ -1,14 +1,32 @@
 import json
 import re
 import sys
+import hashlib
+import argparse
 from pathlib import Path
-from sacrebleu import corpus_bleu
+from concurrent.futures import ProcessPoolExecutor
+from sacrebleu.metrics import BLEU
 import javalang
+from ast_fingerprint import SubtreeFingerprinter, overlap_score
+from disk_cache import DiskCache
+from columnar_output import is_columnar, iter_rows
+from instrumentation import task_context
+from task_profiler import add_profile_args, profiler_from_args, start_worker_profiler, worker_profiler
 
 # Paths
 GOLD_PATH = Path("bug_data/debug_dataset.jsonl")
 PRED_PATH = Path("debug_output.json")
 OUT_PATH  = Path("evaluate_debug.json")
+GOLD_CACHE_PATH = Path(".cache/gold_ast.json")
+SCORE_CACHE_PATH = Path(".cache/eval_scores.sqlite")
+
+# shared across every AST score so signature ids are interned once per process
+fingerprinter = SubtreeFingerprinter()
+# same settings as sacrebleu.corpus_bleu; corpus BLEU is rebuilt from per-task sufficient statistics
+bleu_metric = BLEU()
+# the per-segment statistics come from private sacrebleu methods; if a release drops them, each task
+# keeps its (prediction, gold) pair instead and the corpus score is recomputed with the public API
+BLEU_STATS = all(hasattr(bleu_metric, m) for m in ("_extract_corpus_statistics", "_aggregate_and_compute"))
 
 def extract_code(text: str) -> str:
     m = re.search(r"```(?:[^\n]*)\n([\s\S]*?)```", text)
@@ -31,6 +49,8 @@ def load_gold(path: Path) -> dict:
     return gold
 
 def load_preds(path: Path) -> dict:
+    if is_columnar(path):
+        return load_pred_columns(path)
     preds = {}
     with open(path, encoding="utf-8") as f:
         data = json.load(f)  # single JSON list
@@ -41,10 +61,29 @@ def load_preds(path: Path) -> dict:
                 preds[tid] = ans
     return preds
 
+def load_pred_columns(path: Path) -> dict:
+    """
+    Predictions from a columnar result file. The code column was extracted at generation time;
+    extract_code() leaves it as is, since it has no fence. Rows without code (failed tasks,
+    answers without a code block) fall back to the full answer, exactly as load_preds() scores them.
+    """
+    preds = {}
+    for row in iter_rows(path, ("task_id", "code", "submitted_answer")):
+        if row["task_id"]:
+            preds[row["task_id"]] = (row["code"] or row["submitted_answer"] or "").strip()
+    return preds
+
 def extract_subtrees(code: str) -> set:
     """
     Wrap the snippet in a dummy class, parse into AST, and collect (node_type, child_types) tuples.
     """
+    return fingerprinter.signatures(code)
+
+def reference_subtrees(code: str) -> set:
+    """
+    Original node-by-node implementation (quadratic: node.filter walks every subtree).
+    Only used by --check-ast to verify the fingerprinter reproduces it exactly.
+    """
     # 1) Wrap in a minimal class
     wrapped = f"public class Dummy {{\n{code}\n}}"
     try:
@@ -79,56 +118,206 @@ def ast_score(pred_code: str, ref_code: str) -> float:
     """
     AST score = |subtrees(pred) ∩ subtrees(ref)| / |subtrees(ref)|
     """
-    pred_subs = extract_subtrees(pred_code)
-    ref_subs  = extract_subtrees(ref_code)
-    if not ref_subs:
-        return 0.0
-    overlap = pred_subs & ref_subs
-    return len(overlap) / len(ref_subs)
+    return overlap_score(fingerprinter.fingerprint(pred_code), fingerprinter.fingerprint(ref_code))
+
+def check_ast(pairs) -> int:
+    """Compare fingerprinted subtrees against the reference walk; returns the number of mismatches."""
+    mismatches = 0
+    for tid, code in pairs:
+        if extract_subtrees(code) != reference_subtrees(code):
+            print(f"AST mismatch for {tid}", file=sys.stderr)
+            mismatches += 1
+    return mismatches
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def load_gold_cache(path: Path) -> dict:
+    """sha256(gold code) -> list of [node_type, child_types] signatures, from an earlier run."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get("child_types") != fingerprinter.child_types:
+        return {}
+    return data.get("entries", {})
+
+def save_gold_cache(path: Path, entries: dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"child_types": fingerprinter.child_types, "entries": entries}, f)
+    tmp.replace(path)
+
+def gold_signatures(code: str) -> list:
+    return sorted([name, list(kids)] for name, kids in extract_subtrees(code))
+
+def bleu_statistics(pred_code: str, gold_code: str) -> list:
+    """BLEU sufficient statistics for one segment: lengths plus n-gram match and total counts."""
+    if not BLEU_STATS:
+        return [pred_code, gold_code]
+    return bleu_metric._extract_corpus_statistics([pred_code], [[gold_code]])[0]
+
+def corpus_bleu_from_stats(stats: list) -> float:
+    """Identical to corpus_bleu(hyps, [refs]).score, computed from stored per-segment statistics."""
+    if not BLEU_STATS:
+        return bleu_metric.corpus_score([pred for pred, _ in stats], [[gold for _, gold in stats]]).score
+    return bleu_metric._aggregate_and_compute(stats).score
+
+def score_key(gold_code: str, pred_text: str) -> str:
+    # BLEU_STATS is part of the key: cached statistics and cached text pairs can't be mixed
+    return content_hash(json.dumps([gold_code, pred_text, fingerprinter.child_types, BLEU_STATS], ensure_ascii=False))
+
+def score_task(job):
+    """
+    Score one task; runs in a worker process when --workers > 1.
+    job = (task_id, gold_code, pred_text, gold_sigs) -> (task_id, em, ast, bleu_stats)
+    """
+    tid, gold_code, pred_text, gold_sigs = job
+    pred_code = extract_code(pred_text)
+    em = int(normalize_whitespace(gold_code) == normalize_whitespace(pred_code))
+    a_score = overlap_score(fingerprinter.fingerprint(pred_code), fingerprinter.ids(gold_sigs))
+    return tid, em, a_score, bleu_statistics(pred_code, gold_code)
+
+def profiled_score_task(job):
+    """score_task under the worker process's profiler; returns (result, profile entry)."""
+    entries = []
+    with task_context(job[0]), worker_profiler().task(job[0], sink=entries.append, code_chars=len(job[2])):
+        result = score_task(job)
+    return result, entries[0]
+
+def score_all(jobs, workers: int, chunksize: int, profiler=None):
+    """Yield score_task results in job order, serially or across a process pool."""
+    if profiler is not None:
+        yield from profile_all(jobs, workers, chunksize, profiler)
+        return
+    if workers <= 1:
+        yield from map(score_task, jobs)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(score_task, jobs, chunksize=chunksize)
+
+def profile_all(jobs, workers: int, chunksize: int, profiler):
+    """score_all with every task profiled; worker processes run their own sampler and send entries back."""
+    if workers <= 1:
+        for job in jobs:
+            with task_context(job[0]), profiler.task(job[0], code_chars=len(job[2])):
+                result = score_task(job)
+            yield result
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=start_worker_profiler,
+                             initargs=(profiler.interval, profiler.memory_mb, profiler.memory)) as pool:
+        for result, entry in pool.map(profiled_score_task, jobs, chunksize=chunksize):
+            profiler.add_entry(entry)
+            yield result
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compute EM / BLEU / AST scores for debug_output.json.")
+    parser.add_argument("--preds", type=Path, default=PRED_PATH,
+                        help="predictions: a JSON array (debug_output.json) or a columnar .jsonl.zst file")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="score tasks across this many processes (1 = serial)")
+    parser.add_argument("--chunksize", type=int, default=64,
+                        help="tasks handed to a worker process at a time")
+    parser.add_argument("--gold-cache", type=Path, default=GOLD_CACHE_PATH,
+                        help="where gold-side AST signatures are cached between runs")
+    parser.add_argument("--no-gold-cache", action="store_true")
+    parser.add_argument("--incremental", action="store_true",
+                        help="reuse stored per-task scores; only rescore tasks whose (gold, prediction) changed")
+    parser.add_argument("--score-cache", default=str(SCORE_CACHE_PATH),
+                        help="where per-task scores are stored for --incremental")
+    parser.add_argument("--check-ast", action="store_true",
+                        help="verify the AST fingerprinter against the reference walk and exit")
+    add_profile_args(parser, default_report="eval_profile_report.json")
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
     if not GOLD_PATH.exists():
         print(f"Error: gold file not found at {GOLD_PATH}", file=sys.stderr)
         sys.exit(1)
-    if not PRED_PATH.exists():
-        print(f"Error: predictions file not found at {PRED_PATH}", file=sys.stderr)
+    if not args.preds.exists():
+        print(f"Error: predictions file not found at {args.preds}", file=sys.stderr)
         sys.exit(1)
 
     gold_map = load_gold(GOLD_PATH)
-    pred_map = load_preds(PRED_PATH)
+    pred_map = load_preds(args.preds)
 
     total = len(gold_map)
     if total == 0:
         print("No gold records to evaluate.", file=sys.stderr)
         sys.exit(1)
 
+    if args.check_ast:
+        pairs = [(tid, code) for tid, code in gold_map.items()]
+        pairs += [(tid, extract_code(text)) for tid, text in pred_map.items()]
+        bad = check_ast(pairs)
+        print(f"AST check: {len(pairs) - bad}/{len(pairs)} snippets match the reference walk")
+        sys.exit(1 if bad else 0)
+
+    # --incremental: per-task EM / AST / BLEU statistics keyed by a hash of (gold, prediction)
+    score_cache = DiskCache(args.score_cache, max_bytes=1 << 30) if args.incremental else None
+    score_keys = {tid: score_key(gold_code, pred_map.get(tid, "")) for tid, gold_code in gold_map.items()}
+    scores = {}
+    if score_cache is not None:
+        for tid, key in score_keys.items():
+            raw = score_cache.get(key)
+            if raw is not None:
+                scores[tid] = tuple(json.loads(raw))
+    todo = [tid for tid in gold_map if tid not in scores]
+
+    # Gold-side AST signatures only change when the gold code does; reuse them across runs
+    gold_cache = {} if args.no_gold_cache else load_gold_cache(args.gold_cache)
+    gold_hashes = {tid: content_hash(gold_map[tid]) for tid in todo}
+    missing = sorted({h for h in gold_hashes.values() if h not in gold_cache})
+    if missing:
+        code_by_hash = {h: gold_map[tid] for tid, h in gold_hashes.items()}
+        codes = [code_by_hash[h] for h in missing]
+        if args.workers > 1:
+            with ProcessPoolExecutor(max_workers=args.workers) as pool:
+                sigs = list(pool.map(gold_signatures, codes, chunksize=args.chunksize))
+        else:
+            sigs = [gold_signatures(code) for code in codes]
+        gold_cache.update(zip(missing, sigs))
+        if not args.no_gold_cache:
+            save_gold_cache(args.gold_cache, gold_cache)
+
+    jobs = [
+        (tid, gold_map[tid], pred_map.get(tid, ""), gold_cache[gold_hashes[tid]])
+        for tid in todo
+    ]
+    profiler = profiler_from_args(args)
+    for tid, em, a_score, stats in score_all(jobs, args.workers, args.chunksize, profiler):
+        scores[tid] = (em, a_score, stats)
+        if score_cache is not None:
+            score_cache.set(score_keys[tid], json.dumps([em, a_score, stats]).encode("utf-8"))
+    if score_cache is not None:
+        print(f"Incremental: rescored {len(todo)} of {total} tasks")
+
     per_task_em  = {}
     per_task_ast = {}
-    hyps = []
-    refs = []
+    bleu_stats = []
     em_count = 0
     ast_sum = 0.0
 
-    for tid, gold_code in gold_map.items():
-        pred_text = pred_map.get(tid, "")
-        pred_code = extract_code(pred_text)
+    # aggregate in gold order, so sums (and float rounding) match the serial path exactly
+    for tid in gold_map:
+        em, a_score, stats = scores[tid]
 
         # Exact Match
-        em = int(normalize_whitespace(gold_code) == normalize_whitespace(pred_code))
         per_task_em[tid] = em
         em_count += em
 
         # AST Score
-        a_score = ast_score(pred_code, gold_code)
         per_task_ast[tid] = round(a_score, 4)
         ast_sum += a_score
 
         # for BLEU
-        hyps.append(pred_code)
-        refs.append(gold_code)
+        bleu_stats.append(stats)
 
     em_score  = em_count / total
-    bleu_score = corpus_bleu(hyps, [refs]).score
+    bleu_score = corpus_bleu_from_stats(bleu_stats)
     avg_ast   = ast_sum / total
 
     result = {
@@ -148,5 +337,11 @@ def main():
     print(f"AST Score   = {avg_ast:.4f}")
     print(f"Results saved to {OUT_PATH}")
 
+    if profiler is not None:
+        profiler.stop()
+        profiler.write_report()
+        print(profiler.summary())
+        print(f"Profile saved to {profiler.report_path} (ledger: {profiler.ledger_path})")
+
 if __name__ == "__main__":
     main()
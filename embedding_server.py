@@ -0,0 +1,239 @@
+"""
+Shared embedding service: load the mpnet model once per host and serve it to every worker.
+
+  python embedding_server.py serve --address unix:/tmp/embeddings.sock
+  EMBEDDING_SERVER=unix:/tmp/embeddings.sock python main.py
+
+Concurrent requests are merged into micro-batches of at most --max-batch texts; a batch is
+sent to the model once it is full or --max-wait-ms after its first request arrived.
+
+Protocol (one persistent stream connection per client thread):
+  request   one JSON line: {"kind": "documents" | "query", "texts": [...]}
+  response  one JSON line: {"n": N, "dim": D} followed by N*D little-endian float32,
+            or {"error": "..."}
+Addresses are "unix:/path/to.sock" or "host:port".
+"""
+import os
+import json
+import time
+import queue
+import random
+import socket
+import argparse
+import threading
+import socketserver
+from concurrent.futures import Future
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+def parse_address(address: str):
+    """'unix:/path' -> (AF_UNIX, '/path'); 'host:port' -> (AF_INET, (host, port))."""
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+class MicroBatcher:
+    """
+    Collects embed requests from many threads and runs them through the model in batches.
+    With symmetric=True (models like mpnet that embed queries and documents the same way)
+    queries are batched together with documents through embed_documents.
+    """
+    def __init__(self, embeddings: Embeddings, max_batch: int = 64, max_wait: float = 0.005,
+                 symmetric: bool = True):
+        self.embeddings = embeddings
+        self.symmetric = symmetric
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self.texts = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="embed-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, kind: str, texts: list[str]) -> Future:
+        fut = Future()
+        if self.symmetric:
+            kind = "documents"
+        self._queue.put((kind, texts, fut))
+        return fut
+
+    def _collect(self) -> list:
+        pending = [self._queue.get()]
+        size = len(pending[0][1])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            pending.append(item)
+            size += len(item[1])
+        return pending
+
+    def _loop(self):
+        while True:
+            pending = self._collect()
+            for kind in ("documents", "query"):
+                group = [item for item in pending if item[0] == kind]
+                if group:
+                    self._run(kind, group)
+
+    def _run(self, kind: str, group: list):
+        texts = [text for _, item_texts, _ in group for text in item_texts]
+        try:
+            if kind == "query":
+                vectors = [self.embeddings.embed_query(text) for text in texts]
+            else:
+                vectors = self.embeddings.embed_documents(texts)
+        except Exception as e:
+            for _, _, fut in group:
+                fut.set_exception(e)
+            return
+        self.batches += 1
+        self.texts += len(texts)
+        start = 0
+        for _, item_texts, fut in group:
+            fut.set_result(vectors[start:start + len(item_texts)])
+            start += len(item_texts)
+
+
+def _handler(batcher: MicroBatcher):
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                try:
+                    request = json.loads(line)
+                    vectors = batcher.submit(request.get("kind", "documents"), request["texts"]).result()
+                    array = np.asarray(vectors, dtype="<f4").reshape(len(request["texts"]), -1 if vectors else 0)
+                except Exception as e:
+                    self.wfile.write((json.dumps({"error": str(e)}) + "\n").encode("utf-8"))
+                    continue
+                header = {"n": array.shape[0], "dim": array.shape[1]}
+                self.wfile.write((json.dumps(header) + "\n").encode("utf-8") + array.tobytes())
+                self.wfile.flush()
+
+    return Handler
+
+
+# listen backlog: a burst of workers connecting at once must not overflow it (socketserver's default is 5)
+LISTEN_BACKLOG = 128
+# connect attempts while the server's backlog is full or it is (re)starting
+CONNECT_RETRIES = 5
+CONNECT_BACKOFF = 0.05
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = LISTEN_BACKLOG
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = LISTEN_BACKLOG
+
+
+def make_server(address: str, batcher: MicroBatcher):
+    family, addr = parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(addr):
+            os.remove(addr)
+        return _UnixServer(addr, _handler(batcher))
+    return _TCPServer(addr, _handler(batcher))
+
+
+class EmbeddingClient(Embeddings):
+    """Drop-in Embeddings backed by the embedding server; one connection per calling thread."""
+    def __init__(self, address: str, timeout: float = 120.0):
+        self.address = address
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        family, addr = parse_address(self.address)
+        for attempt in range(CONNECT_RETRIES):
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(addr)
+                break
+            except (BlockingIOError, ConnectionRefusedError, FileNotFoundError):
+                # EAGAIN: the listen backlog is full; ECONNREFUSED / no socket: the server is restarting
+                sock.close()
+                if attempt == CONNECT_RETRIES - 1:
+                    raise
+                time.sleep(random.uniform(0, CONNECT_BACKOFF * 2 ** attempt))
+        self._local.sock = sock
+        self._local.file = sock.makefile("rwb")
+        return self._local.file
+
+    def _close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            self._local.file.close()
+            sock.close()
+            self._local.sock = None
+
+    def _request(self, kind: str, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        payload = (json.dumps({"kind": kind, "texts": texts}, ensure_ascii=False) + "\n").encode("utf-8")
+        for attempt in range(2):
+            try:
+                f = self._local.file if getattr(self._local, "sock", None) else self._connect()
+                f.write(payload)
+                f.flush()
+                header = json.loads(f.readline() or b"null")
+                if header is None:
+                    raise ConnectionError("embedding server closed the connection")
+                if "error" in header:
+                    raise RuntimeError(f"embedding server error: {header['error']}")
+                data = f.read(header["n"] * header["dim"] * 4)
+                return np.frombuffer(data, dtype="<f4").reshape(header["n"], header["dim"]).tolist()
+            except (ConnectionError, OSError):
+                # the server may have restarted; reconnect once
+                self._close()
+                if attempt:
+                    raise
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self._request("documents", list(texts))
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._request("query", [text])[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared micro-batching embedding server.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve")
+    serve.add_argument("--address", default="unix:/tmp/embeddings.sock", help="unix:/path or host:port")
+    serve.add_argument("--model", default="sentence-transformers/all-mpnet-base-v2")
+    serve.add_argument("--max-batch", type=int, default=64, help="most texts embedded in one model call")
+    serve.add_argument("--max-wait-ms", type=float, default=5.0,
+                       help="how long a batch waits for more requests after the first one arrives")
+    serve.add_argument("--asymmetric", action="store_true",
+                       help="embed queries with embed_query instead of batching them with documents")
+    args = parser.parse_args()
+
+    from langchain_huggingface import HuggingFaceEmbeddings
+    embeddings = HuggingFaceEmbeddings(model_name=args.model)
+    batcher = MicroBatcher(embeddings, max_batch=args.max_batch, max_wait=args.max_wait_ms / 1000,
+                           symmetric=not args.asymmetric)
+    with make_server(args.address, batcher) as server:
+        print(f"Serving {args.model} on {args.address}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    print(f"Served {batcher.texts} texts in {batcher.batches} batches")
+
+
+if __name__ == "__main__":
+    main()
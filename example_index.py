@@ -0,0 +1,75 @@
+import re
+import math
+from collections import Counter
+from instrumentation import CHARS_PER_TOKEN
+
+_CODE_TOKEN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+|[^\sA-Za-z0-9_]")
+
+
+def code_features(code: str) -> Counter:
+    """Token unigrams and bigrams of a code snippet (whitespace-insensitive)."""
+    tokens = _CODE_TOKEN.findall(code)
+    features = Counter(tokens)
+    features.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+    return features
+
+
+def render_example(ex: dict) -> str:
+    """One few-shot block, exactly as it appears in the repair prompt."""
+    return "\n".join([
+        "### Example",
+        f"Q: {ex['Question']}",
+        "```<auto-detect>",
+        ex["code"],
+        "```",
+        "Patched code:",
+        "```java",  # or the language tag of that example
+        ex["Final answer"],
+        "```",
+        "",
+    ])
+
+
+class ExampleIndex:
+    """
+    TF-IDF vectors over the code of the few-shot examples, built once.
+    select() returns the examples most similar to a buggy snippet that fit a token budget.
+    """
+    def __init__(self, examples: list[dict]):
+        self.examples = examples
+        self.blocks = [render_example(ex) for ex in examples]
+        self.costs = [len(block) // CHARS_PER_TOKEN + 1 for block in self.blocks]
+        features = [code_features(ex["code"]) for ex in examples]
+        df = Counter()
+        for f in features:
+            df.update(f.keys())
+        n = len(examples)
+        self.idf = {term: math.log((1 + n) / (1 + count)) + 1.0 for term, count in df.items()}
+        self.vectors = [self._vectorize(f) for f in features]
+
+    def _vectorize(self, features: Counter) -> dict:
+        vec = {t: (1.0 + math.log(c)) * self.idf[t] for t, c in features.items() if t in self.idf}
+        norm = math.sqrt(sum(v * v for v in vec.values()))
+        return {t: v / norm for t, v in vec.items()} if norm else {}
+
+    def similarities(self, code: str) -> list[float]:
+        query = self._vectorize(code_features(code))
+        return [sum(w * vec.get(t, 0.0) for t, w in query.items()) for vec in self.vectors]
+
+    def select(self, code: str, max_examples: int, budget_tokens: int) -> list[int]:
+        """
+        Indices of up to max_examples examples, picked most similar first, whose rendered blocks fit
+        in budget_tokens. Ties keep file order, so unrelated input falls back to the first examples.
+        The indices are returned in file order so the same selection always renders the same prompt.
+        """
+        scores = self.similarities(code)
+        ranked = sorted(range(len(self.examples)), key=lambda i: (-scores[i], i))
+        chosen, used = [], 0
+        for i in ranked:
+            if len(chosen) >= max_examples:
+                break
+            if used + self.costs[i] > budget_tokens:
+                continue
+            chosen.append(i)
+            used += self.costs[i]
+        return sorted(chosen)
@@ -0,0 +1,216 @@
+"""
+Local stand-ins for the two LLM backends, for offline benchmarking:
+
+  FakeOllama - Ollama-compatible /api/generate and /api/chat (JSON or NDJSON streaming).
+               It answers repair prompts by echoing the buggy code back in a ```java fence,
+               followed by an explanation.
+  FakeGroq   - OpenAI/Groq-compatible /openai/v1/chat/completions. When tools are bound and no
+               tool result has come back yet, it emits a tool call; otherwise a FINAL ANSWER.
+
+Latency is sampled per request: a time-to-first-token from a distribution spec plus
+completion_tokens / tokens_per_second.
+"""
+import json
+import math
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def parse_latency(spec: str):
+    """
+    'fixed:0.2' | 'uniform:0.1,0.5' | 'lognormal:MEDIAN,SIGMA' -> zero-argument sampler (seconds).
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "lognormal":
+        mu = math.log(values[0])
+        return lambda: random.lognormvariate(mu, values[1])
+    raise ValueError(f"unknown latency distribution {spec!r}")
+
+
+_ids = iter(range(1, 1 << 62))
+_ids_lock = threading.Lock()
+
+
+def server_id() -> int:
+    with _ids_lock:
+        return next(_ids)
+
+
+def count_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class _FakeServer:
+    def __init__(self, latency: str = "fixed:0.05", tokens_per_second: float = 200.0, port: int = 0):
+        self.sample_latency = parse_latency(latency)
+        self.tokens_per_second = tokens_per_second
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def delay(self, completion_tokens: int) -> float:
+        return self.sample_latency() + completion_tokens / self.tokens_per_second
+
+    def route(self, path: str, body: dict, handler):
+        raise NotImplementedError
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, payload: dict, status: int = 200):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self.send_json({"models": [], "data": []})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                server.route(self.path, body, self)
+
+        return Handler
+
+
+def fake_repair_answer(prompt: str, explanation_tokens: int = 120) -> str:
+    # echo the last code block of the prompt (the task's buggy code) as the "patch"
+    code = prompt.rsplit("```<auto-detect>\n", 1)[-1].split("\n```", 1)[0]
+    explanation = " ".join(["The", "patch", "fixes", "the", "bug."] * (explanation_tokens // 5))
+    return f"Patched code:\n```java\n{code}\n```\n\nExplanation:\n{explanation}"
+
+
+class FakeOllama(_FakeServer):
+    def __init__(self, *args, explanation_tokens: int = 120, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.explanation_tokens = explanation_tokens
+
+    def route(self, path, body, handler):
+        if path.startswith("/api/show"):
+            return handler.send_json({"model_info": {}, "details": {}})
+        if path.startswith("/api/generate"):
+            prompt = body.get("prompt", "")
+            chat = False
+        elif path.startswith("/api/chat"):
+            prompt = "\n".join(m.get("content", "") for m in body.get("messages", []))
+            chat = True
+        else:
+            return handler.send_json({"error": f"unknown path {path}"}, 404)
+
+        self.count_request()
+        text = fake_repair_answer(prompt, self.explanation_tokens)
+        prompt_tokens, completion_tokens = count_tokens(prompt), count_tokens(text)
+
+        def chunk(piece: str, done: bool) -> dict:
+            out = {"model": body.get("model", ""), "done": done}
+            if chat:
+                out["message"] = {"role": "assistant", "content": piece}
+            else:
+                out["response"] = piece
+            if done:
+                out.update(prompt_eval_count=prompt_tokens, eval_count=completion_tokens, done_reason="stop")
+            return out
+
+        if not body.get("stream", False):
+            time.sleep(self.delay(completion_tokens))
+            return handler.send_json(chunk(text, True))
+
+        # NDJSON stream, one line per ~4-char token; the client may hang up early
+        time.sleep(self.sample_latency())
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/x-ndjson")
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+        per_token = 1.0 / self.tokens_per_second
+        try:
+            for i in range(0, len(text), 4):
+                time.sleep(per_token)
+                line = (json.dumps(chunk(text[i:i + 4], False)) + "\n").encode("utf-8")
+                handler.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+            line = (json.dumps(chunk("", True)) + "\n").encode("utf-8")
+            handler.wfile.write(b"%x\r\n%s\r\n0\r\n\r\n" % (len(line), line))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class FakeGroq(_FakeServer):
+    def __init__(self, *args, tool_rounds: int = 1, tools_per_turn: int = 1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tool_rounds = tool_rounds
+        self.tools_per_turn = tools_per_turn
+
+    def route(self, path, body, handler):
+        if not path.endswith("/chat/completions"):
+            return handler.send_json({"error": {"message": f"unknown path {path}"}}, 404)
+        self.count_request()
+        messages = body.get("messages", [])
+        prompt = "\n".join(str(m.get("content") or "") for m in messages)
+        rounds = sum(1 for m in messages if m.get("role") == "assistant" and m.get("tool_calls"))
+        question = next((m.get("content", "") for m in messages if m.get("role") == "user"), "")
+
+        message = {"role": "assistant", "content": None}
+        if body.get("tools") and rounds < self.tool_rounds:
+            names = [t["function"]["name"] for t in body["tools"]]
+            message["tool_calls"] = [{
+                "id": f"call_{server_id()}",
+                "type": "function",
+                "function": {
+                    "name": names[(rounds + i) % len(names)],
+                    "arguments": json.dumps({"input": question[:200]}),
+                },
+            } for i in range(self.tools_per_turn)]
+            finish, completion_tokens = "tool_calls", 20 * self.tools_per_turn
+        else:
+            message["content"] = "FINAL ANSWER: 42"
+            finish, completion_tokens = "stop", 8
+
+        time.sleep(self.delay(completion_tokens))
+        prompt_tokens = count_tokens(prompt)
+        handler.send_json({
+            "id": f"chatcmpl-{server_id()}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", ""),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
@@ -0,0 +1,292 @@
+import json
+import time
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import Counter, defaultdict
+
+# rough chars-per-token ratio for client-side token estimates (prompt budgets, few-shot costs, and
+# prompt counts Ollama didn't report); neither Groq nor Ollama exposes its tokenizer here
+CHARS_PER_TOKEN = 4
+
+# task_id of the task being processed on this thread (LangGraph copies it into node/tool threads)
+current_task = contextvars.ContextVar("current_task", default="")
+
+
+# thread ident -> task_id it is working on; read by the --profile sampler (task_profiler.py)
+task_threads = {}
+
+# task_id -> CPU seconds spent on it by helper threads (graph nodes, tool calls); only tasks
+# a profiler is watching (watch_helper_cpu) are charged
+helper_cpu = {}
+_helper_cpu_lock = threading.Lock()
+
+
+def watch_helper_cpu(task_id: str):
+    with _helper_cpu_lock:
+        helper_cpu[task_id] = 0.0
+
+
+def pop_helper_cpu(task_id: str) -> float:
+    with _helper_cpu_lock:
+        return helper_cpu.pop(task_id, 0.0)
+
+
+@contextmanager
+def thread_task(task_id: str, charge_cpu: bool = True):
+    """
+    Mark the calling thread as working on task_id (restores the previous mark on exit).
+    With charge_cpu, the thread's CPU time inside the block is added to helper_cpu[task_id],
+    unless the thread is already marked with that task (nested marks would count twice).
+    """
+    ident = threading.get_ident()
+    previous = task_threads.get(ident)
+    task_threads[ident] = task_id
+    cpu_start = time.thread_time() if charge_cpu and previous != task_id and task_id in helper_cpu else None
+    try:
+        yield
+    finally:
+        if cpu_start is not None:
+            with _helper_cpu_lock:
+                if task_id in helper_cpu:
+                    helper_cpu[task_id] += time.thread_time() - cpu_start
+        if previous is None:
+            task_threads.pop(ident, None)
+        else:
+            task_threads[ident] = previous
+
+
+@contextmanager
+def task_context(task_id: str):
+    token = current_task.set(task_id)
+    try:
+        # the task's own thread is measured by the profiler itself
+        with thread_task(task_id, charge_cpu=False):
+            yield
+    finally:
+        current_task.reset(token)
+
+
+def in_task_thread(fn, *args, **kwargs):
+    """Run fn on a helper thread (inside a copied context) marked with the current task."""
+    with thread_task(current_task.get()):
+        return fn(*args, **kwargs)
+
+
+def _new_node_stats():
+    return {"calls": 0, "wall_s": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "cache_hits": 0}
+
+
+def _new_totals():
+    return {"tasks": 0, "nodes": defaultdict(_new_node_stats), "tools": Counter(), "speculation": Counter(),
+            "depth_max": 0, "depth_sum": 0}
+
+
+def _task_view(task) -> dict:
+    return {
+        "nodes": {name: dict(stats) for name, stats in task["nodes"].items()},
+        "tools": dict(task["tools"]),
+        "loop_depth": task["loop_depth"],
+        "speculation": dict(task["speculation"]),
+    }
+
+
+def _fold(totals, task):
+    totals["tasks"] += 1
+    for name, stats in task["nodes"].items():
+        for key, value in stats.items():
+            totals["nodes"][name][key] += value
+    totals["tools"].update(task["tools"])
+    totals["speculation"].update(task["speculation"])
+    totals["depth_max"] = max(totals["depth_max"], task["loop_depth"])
+    totals["depth_sum"] += task["loop_depth"]
+
+
+class Recorder:
+    """
+    Per-task, per-node wall time and token counts for both pipelines: the causal graph
+    (retriever / assistant / tools) and the repair planner (generate_code_patch, RepairAgent.invoke).
+    finish_task() folds a finished task into the aggregates; its per-task breakdown is only
+    kept when keep_per_task is set (main.py sets it for --metrics-json).
+    """
+    def __init__(self, keep_per_task: bool = True):
+        self.keep_per_task = keep_per_task
+        self._lock = threading.Lock()
+        self._totals = _new_totals()
+        self._finished = {}
+        self.tasks = defaultdict(lambda: {
+            "nodes": defaultdict(_new_node_stats),
+            "tools": Counter(),
+            "loop_depth": 0,
+            "speculation": Counter(),
+        })
+
+    def record_node(self, node: str, wall_s: float, prompt_tokens: int = 0, completion_tokens: int = 0,
+                    cache_hit: bool = False, task_id: str = None):
+        task_id = current_task.get() if task_id is None else task_id
+        with self._lock:
+            stats = self.tasks[task_id]["nodes"][node]
+            stats["calls"] += 1
+            stats["wall_s"] += wall_s
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+            stats["cache_hits"] += int(cache_hit)
+
+    def record_tools(self, names):
+        with self._lock:
+            self.tasks[current_task.get()]["tools"].update(names)
+
+    def record_loop(self):
+        """One assistant <-> tools round trip."""
+        with self._lock:
+            self.tasks[current_task.get()]["loop_depth"] += 1
+
+    def record_speculation(self, outcome: str, count: int = 1):
+        """Speculative tool prefetches: outcome is "started", "hit" or "discarded"."""
+        with self._lock:
+            self.tasks[current_task.get()]["speculation"][outcome] += count
+
+    def task_tokens(self, task_id: str) -> tuple[int, int]:
+        """(prompt, completion) tokens recorded so far for one task, over all nodes."""
+        with self._lock:
+            if task_id not in self.tasks:
+                return 0, 0
+            nodes = self.tasks[task_id]["nodes"].values()
+            return sum(s["prompt_tokens"] for s in nodes), sum(s["completion_tokens"] for s in nodes)
+
+    def finish_task(self, task_id: str):
+        """Fold a finished task into the aggregates and drop its live counters."""
+        with self._lock:
+            task = self.tasks.pop(task_id, None)
+            if task is None:
+                return
+            _fold(self._totals, task)
+            if self.keep_per_task:
+                self._finished[task_id] = _task_view(task)
+
+    def reset(self):
+        with self._lock:
+            self.tasks.clear()
+            self._totals = _new_totals()
+            self._finished.clear()
+
+    def summary(self) -> dict:
+        with self._lock:
+            totals = _new_totals()
+            for key in ("tasks", "depth_max", "depth_sum"):
+                totals[key] = self._totals[key]
+            for name, stats in self._totals["nodes"].items():
+                totals["nodes"][name].update(stats)
+            totals["tools"].update(self._totals["tools"])
+            totals["speculation"].update(self._totals["speculation"])
+            # tasks still running (or activity outside any finished task)
+            for task in self.tasks.values():
+                _fold(totals, task)
+            per_task = {}
+            if self.keep_per_task:
+                per_task = dict(self._finished)
+                per_task.update((tid, _task_view(task)) for tid, task in self.tasks.items())
+        nodes = {name: dict(stats) for name, stats in totals["nodes"].items()}
+        for stats in nodes.values():
+            stats["mean_wall_s"] = stats["wall_s"] / stats["calls"] if stats["calls"] else 0.0
+        speculation = totals["speculation"]
+        return {
+            "tasks": totals["tasks"],
+            "nodes": nodes,
+            "tools": dict(totals["tools"]),
+            "loop_depth": {
+                "max": totals["depth_max"],
+                "mean": totals["depth_sum"] / totals["tasks"] if totals["tasks"] else 0.0,
+            },
+            "speculation": {
+                "started": speculation["started"],
+                "hits": speculation["hit"],
+                "discarded": speculation["discarded"],
+                "hit_rate": speculation["hit"] / speculation["started"] if speculation["started"] else 0.0,
+            },
+            "per_task": per_task,
+        }
+
+    def to_json(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=2, ensure_ascii=False)
+
+    def to_prometheus(self) -> str:
+        """Aggregates in Prometheus text exposition format."""
+        summary = self.summary()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        nodes = summary["nodes"]
+        metric("agent_node_calls_total", "counter", "Node invocations.",
+               [({"node": n}, s["calls"]) for n, s in nodes.items()])
+        metric("agent_node_wall_seconds_total", "counter", "Wall time spent in each node.",
+               [({"node": n}, round(s["wall_s"], 6)) for n, s in nodes.items()])
+        metric("agent_node_tokens_total", "counter", "LLM tokens by node and direction.",
+               [({"node": n, "kind": "prompt"}, s["prompt_tokens"]) for n, s in nodes.items()]
+               + [({"node": n, "kind": "completion"}, s["completion_tokens"]) for n, s in nodes.items()])
+        metric("agent_node_cache_hits_total", "counter", "Calls served from a completion cache.",
+               [({"node": n}, s["cache_hits"]) for n, s in nodes.items()])
+        metric("agent_tool_calls_total", "counter", "Tool calls by tool name.",
+               [({"tool": t}, c) for t, c in summary["tools"].items()])
+        metric("agent_speculative_prefetch_total", "counter", "Speculative tool prefetches by outcome.",
+               [({"outcome": k}, summary["speculation"][k]) for k in ("started", "hits", "discarded")])
+        metric("agent_tasks_total", "counter", "Tasks with recorded activity.", [({}, summary["tasks"])])
+        metric("agent_loop_depth_max", "gauge", "Most assistant/tools round trips in one task.",
+               [({}, summary["loop_depth"]["max"])])
+        return "\n".join(lines) + "\n"
+
+    def to_prometheus_file(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+
+
+recorder = Recorder()
+
+
+def message_tokens(messages) -> tuple[int, int]:
+    """(prompt, completion) tokens reported by the LLM on any returned AIMessage."""
+    prompt = completion = 0
+    for msg in messages:
+        usage = getattr(msg, "usage_metadata", None) or {}
+        prompt += usage.get("input_tokens", 0)
+        completion += usage.get("output_tokens", 0)
+    return prompt, completion
+
+
+def instrument_node(name: str):
+    """Wrap a graph node (state -> update) to record wall time and any token usage in its output."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(state, *args, **kwargs):
+            start = time.perf_counter()
+            # LangGraph runs nodes on its own threads; mark them for the profiler
+            with thread_task(current_task.get()):
+                update = fn(state, *args, **kwargs)
+            wall = time.perf_counter() - start
+            messages = update.get("messages", []) if isinstance(update, dict) else []
+            recorder.record_node(name, wall, *message_tokens(messages))
+            return update
+        return wrapper
+    return decorator
+
+
+def timed_call(name: str):
+    """Record wall time of a plain function call (e.g. generate_code_patch) under `name`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                recorder.record_node(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
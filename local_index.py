@@ -0,0 +1,160 @@
+"""
+Local, memory-mapped alternative to SupabaseVectorStore.
+
+An index directory holds:
+  embeddings.npy  - float32 matrix (n_docs x dim), rows L2-normalized, opened with mmap so
+                    every worker process shares the same page cache instead of its own copy
+  meta.jsonl      - one {"id", "content", "metadata"} line per row, in the same order
+
+Build it once from the Supabase `documents` table (or from a JSONL corpus):
+  python local_index.py build --source supabase --out index
+  python local_index.py build --source jsonl --input corpus.jsonl --out index
+"""
+import os
+import json
+import argparse
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+EMBEDDINGS_FILE = "embeddings.npy"
+META_FILE = "meta.jsonl"
+
+
+def normalize_rows(matrix) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k(scores: np.ndarray, k: int):
+    """Indices of the k best scores along the last axis, best first."""
+    k = min(k, scores.shape[-1])
+    idx = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    order = np.argsort(-np.take_along_axis(scores, idx, axis=-1), axis=-1)
+    return np.take_along_axis(idx, order, axis=-1)
+
+
+class LocalVectorIndex(VectorStore):
+    """Cosine-similarity top-k over a memory-mapped embedding matrix."""
+    def __init__(self, directory: str, embedding):
+        self.directory = directory
+        self.embedding = embedding
+        self.vectors = np.load(os.path.join(directory, EMBEDDINGS_FILE), mmap_mode="r")
+        self.records = []
+        with open(os.path.join(directory, META_FILE), encoding="utf-8") as f:
+            for line in f:
+                self.records.append(json.loads(line))
+        if len(self.records) != self.vectors.shape[0]:
+            raise ValueError(
+                f"{directory}: {self.vectors.shape[0]} vectors but {len(self.records)} metadata rows"
+            )
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    def _document(self, i: int, score: float) -> Document:
+        rec = self.records[i]
+        metadata = dict(rec.get("metadata") or {})
+        metadata.setdefault("id", rec.get("id"))
+        metadata["score"] = float(score)
+        return Document(page_content=rec["content"], metadata=metadata)
+
+    def search_vectors(self, queries, k: int = 4) -> list[list[Document]]:
+        """Top-k documents for each row of a (n_queries x dim) matrix, in one matrix product."""
+        queries = normalize_rows(np.atleast_2d(queries))
+        scores = queries @ self.vectors.T
+        best = top_k(scores, k)
+        return [
+            [self._document(i, scores[row, i]) for i in best[row]]
+            for row in range(best.shape[0])
+        ]
+
+    def similarity_search_by_vector(self, embedding, k: int = 4, **kwargs) -> list[Document]:
+        return self.search_vectors(embedding, k)[0]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> list[Document]:
+        return self.similarity_search_by_vector(self.embedding.embed_query(query), k)
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        raise NotImplementedError("build the index with `python local_index.py build`")
+
+
+def write_index(directory: str, vectors, records: list[dict]):
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, EMBEDDINGS_FILE), normalize_rows(vectors))
+    with open(os.path.join(directory, META_FILE), "w", encoding="utf-8") as f:
+        for rec in records:
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+
+
+def export_supabase(table: str = "documents", page_size: int = 500):
+    """Pull every row (content, metadata, stored embedding) out of the Supabase table."""
+    from dotenv import load_dotenv
+    from supabase.client import create_client
+    load_dotenv()
+    client = create_client(os.environ.get("SUPABASE_URL"), os.environ.get("SUPABASE_SERVICE_KEY"))
+    vectors, records = [], []
+    start = 0
+    while True:
+        rows = (
+            client.table(table)
+            .select("id, content, metadata, embedding")
+            .range(start, start + page_size - 1)
+            .execute()
+            .data
+        )
+        for row in rows:
+            emb = row["embedding"]
+            vectors.append(json.loads(emb) if isinstance(emb, str) else emb)
+            records.append({"id": row.get("id"), "content": row["content"], "metadata": row.get("metadata") or {}})
+        if len(rows) < page_size:
+            break
+        start += page_size
+    return vectors, records
+
+
+def ingest_jsonl(path: str, batch_size: int = 64):
+    """Embed a JSONL corpus of {"content", "metadata"?, "id"?} records with the retriever's model."""
+    from causal_analyzer import get_embeddings
+    embeddings = get_embeddings()
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f):
+            rec = json.loads(line)
+            records.append({"id": rec.get("id", n), "content": rec["content"], "metadata": rec.get("metadata") or {}})
+    vectors = []
+    for start in range(0, len(records), batch_size):
+        batch = records[start:start + batch_size]
+        vectors.extend(embeddings.embed_documents([rec["content"] for rec in batch]))
+    return vectors, records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a local memory-mapped vector index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build")
+    build.add_argument("--source", choices=("supabase", "jsonl"), default="supabase")
+    build.add_argument("--input", help="JSONL corpus (for --source jsonl)")
+    build.add_argument("--table", default="documents")
+    build.add_argument("--batch-size", type=int, default=64)
+    build.add_argument("--out", default="index")
+    args = parser.parse_args()
+
+    if args.source == "supabase":
+        vectors, records = export_supabase(args.table)
+    else:
+        if not args.input:
+            parser.error("--source jsonl needs --input")
+        vectors, records = ingest_jsonl(args.input, args.batch_size)
+    if not records:
+        parser.error("no documents found")
+    write_index(args.out, vectors, records)
+    print(f"Wrote {len(records)} vectors to {args.out}/")
+
+
+if __name__ == "__main__":
+    main()
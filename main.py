@@ -1,9 +1,23 @@
 import os
 import json
+import time
+import hashlib
+import argparse
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 from langchain_core.messages import HumanMessage
-from causal_analyzer import build_graph as build_default_agent
 import repair_engine
-from repair_engine import generate_code_patch
+from repair_engine import generate_code_patch, split_patch
+from tool_cache import tool_cache
+from checkpoint import (
+    FSYNC_POLICIES, CheckpointWriter, checkpoint_path_for, finalize, iter_final_records, load_completed, retire,
+)
+from columnar_output import columnar_path_for, write_columnar
+from startup import startup_report, timed
+from streaming_json import iter_records
+from instrumentation import recorder, task_context
+from task_profiler import add_profile_args, profiler_from_args
 
 INPUT_PATH = "bug_data/debug_dataset.jsonl"
 # INPUT_PATH = "student_data/questions.json"
@@ -11,24 +25,55 @@ INPUT_PATH = "bug_data/debug_dataset.jsonl"
 OUTPUT_PATH = "output.json"
 
 
-def load_questions(file_path):
+def shard_of(task_id: str, num_shards: int) -> int:
+    """Stable shard assignment (same on every node and every run, unlike hash())."""
+    digest = hashlib.sha1(task_id.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % num_shards
+
+
+def iter_questions(file_path, shard=None):
+    """
+    Stream questions (and metadata) from JSON or JSONL, preserving all fields.
+    JSONL is read line by line and JSON arrays are parsed incrementally.
+    shard=(i, n) keeps only the tasks whose task_id hashes to shard i of n.
+    """
+    for entry in iter_records(file_path):
+        q = entry.get("question") or entry.get("Question")
+        if not q:
+            continue
+        if shard and shard_of(entry.get("task_id", ""), shard[1]) != shard[0]:
+            continue
+        yield entry
+
+
+def load_questions(file_path, shard=None):
     """Load questions (and metadata) from JSON or JSONL, preserving all fields."""
-    entries = []
-    if file_path.endswith(".json"):
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            for entry in data:
-                q = entry.get("question") or entry.get("Question")
-                if q:
-                    entries.append(entry)
-    elif file_path.endswith(".jsonl"):
-        with open(file_path, "r", encoding="utf-8") as f:
-            for line in f:
-                entry = json.loads(line)
-                q = entry.get("question") or entry.get("Question")
-                if q:
-                    entries.append(entry)
-    return entries
+    return list(iter_questions(file_path, shard))
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def merge_outputs(paths, input_path, output_path):
+    """Combine per-shard outputs (output.json arrays or checkpoint .jsonl files) into one output.json in input order."""
+    merged = output_path + ".merge.jsonl"
+    if os.path.exists(merged):
+        os.remove(merged)
+    with CheckpointWriter(merged, fsync="never") as writer:
+        for path in paths:
+            for rec in iter_records(path):
+                writer.write(rec)
+    written = finalize(merged, output_path, (item.get("task_id", "") for item in iter_questions(input_path)))
+    os.remove(merged)
+    return written
 
 
 def run_agent_on_questions(entries, default_agent, repair_agent):
@@ -65,61 +110,346 @@ def run_agent_on_questions(entries, default_agent, repair_agent):
     return results
 
 
+class RateLimiter:
+    """Spread calls to one backend so that at most `rate` start per second (0 disables)."""
+    def __init__(self, rate: float = 0.0):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def answer_entry(item, default_agent, examples, similar_docs=None):
+    """Answer one task: code_repair entries go to the repair planner, everything else to the causal graph."""
+    question = item.get("Question") or item.get("question")
+    if item.get("type", "") == "code_repair":
+        # code-repair path
+        return generate_code_patch(
+            question=question,
+            code=item.get("code", ""),
+            examples=examples
+        )
+    # default (causal) path
+    state = {"messages": [HumanMessage(content=question)]}
+    if similar_docs:
+        state["similar_docs"] = similar_docs
+    try:
+        out = default_agent.invoke(state)
+    except Exception:
+        # a run that fails after the retriever would leave its prefetches running
+        from causal_analyzer import discard_task_speculations
+        discard_task_speculations()
+        raise
+    text = out["messages"][-1].content
+    return text.removeprefix("FINAL ANSWER: ").strip()
+
+
+class TaskRunner:
+    """
+    Run code_repair and causal tasks in parallel. Each backend (local Ollama planner,
+    Groq causal graph) gets its own thread pool and rate limiter. Every finished task is
+    handed to its `sink` (e.g. CheckpointWriter.write) as soon as it completes.
+    At most `max_in_flight` tasks are queued or running; submit() blocks until one finishes,
+    so the next chunk can be prepared while the previous one is still running.
+    If a sink fails (e.g. the checkpoint can't be written), the run stops: the next submit()
+    or close() raises that error instead of silently dropping the task's answer.
+    With a TaskProfiler, each task is also profiled (time, memory, call stacks).
+    """
+    def __init__(self, examples, repair_workers=1, causal_workers=1, repair_rate=0.0, causal_rate=0.0,
+                 max_in_flight=256, profiler=None):
+        self.default_agent = None   # set once the first causal task shows up
+        self.examples = examples
+        self.profiler = profiler
+        self.pools = {
+            "repair": ThreadPoolExecutor(max_workers=repair_workers, thread_name_prefix="repair"),
+            "causal": ThreadPoolExecutor(max_workers=causal_workers, thread_name_prefix="causal"),
+        }
+        self.limiters = {"repair": RateLimiter(repair_rate), "causal": RateLimiter(causal_rate)}
+        self._slots = threading.BoundedSemaphore(max(1, max_in_flight))
+        self._error = None   # first exception raised while recording a finished task
+
+    def submit(self, item, sink, similar_docs=None):
+        """Schedule one task; `similar_docs` are its retriever neighbours precomputed by search_similar()."""
+        backend = "repair" if item.get("type", "") == "code_repair" else "causal"
+        self._raise_if_failed()
+        self._slots.acquire()
+        try:
+            future = self.pools[backend].submit(self._task, item, backend, sink, similar_docs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._task_done)
+
+    def _task_done(self, future):
+        if not future.cancelled() and future.exception() is not None and self._error is None:
+            self._error = future.exception()
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise self._error
+
+    def _task(self, item, backend, sink, similar_docs):
+        try:
+            self.limiters[backend].acquire()
+            record = {"task_id": item.get("task_id", ""), "type": item.get("type", "")}
+            start = time.perf_counter()
+            profiler = self.profiler
+            try:
+                with task_context(record["task_id"]), \
+                        (profiler.task(record["task_id"], type=record["type"], code_chars=len(item.get("code", "")))
+                         if profiler else nullcontext()):
+                    record["submitted_answer"] = answer_entry(item, self.default_agent, self.examples, similar_docs)
+                if backend == "repair":
+                    # split the patch out now so readers of the columnar output don't re-parse it
+                    fields = split_patch(record["submitted_answer"])
+                    record["code"], record["explanation"] = fields["code"], fields["explanation"]
+            except Exception as e:
+                record["submitted_answer"] = f"AGENT ERROR: {e}"
+                record["error"] = True
+            record["latency_s"] = round(time.perf_counter() - start, 4)
+            record["prompt_tokens"], record["completion_tokens"] = recorder.task_tokens(record["task_id"])
+            recorder.finish_task(record["task_id"])
+            sink(record)
+        finally:
+            self._slots.release()
+
+    def close(self, cancel: bool = False):
+        """Wait for every submitted task to finish (queued ones are dropped after a failure or with cancel)."""
+        for pool in self.pools.values():
+            pool.shutdown(wait=True, cancel_futures=cancel or self._error is not None)
+        self._raise_if_failed()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            # already failing: stop scheduling, let running tasks finish, keep the original error
+            for pool in self.pools.values():
+                pool.shutdown(wait=True, cancel_futures=True)
+
+
+def answer_from_cache(answer_cache, items, questions, vectors, write):
+    """
+    Answer causal tasks whose question is a near-duplicate of an already answered one straight from
+    the semantic answer cache; their records carry the hit's provenance under "semantic_cache".
+    Returns the misses as (item, question, vector) and a sink that also caches the misses' answers.
+    """
+    misses = []
+    for item, question, vector in zip(items, questions, vectors):
+        hit = answer_cache.lookup(vector)
+        if hit is None:
+            misses.append((item, question, vector))
+            continue
+        write({
+            "task_id": item.get("task_id", ""),
+            "type": item.get("type", ""),
+            "submitted_answer": hit.pop("answer"),
+            "semantic_cache": hit,
+            "latency_s": 0.0,
+        })
+    remember = {item.get("task_id", ""): (question, vector) for item, question, vector in misses}
+
+    def sink(record):
+        write(record)
+        if record["task_id"] in remember and not record.get("error"):
+            question, vector = remember[record["task_id"]]
+            answer_cache.add(vector, question, record["submitted_answer"], record["task_id"])
+
+    return misses, sink
+
+
 def save_results(results, output_path):
     with open(output_path, "w", encoding="utf-8") as f:
         json.dump(results, f, ensure_ascii=False, indent=2)
     print(f"Results saved to: {output_path}")
 
 
+def parse_shard(value):
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {value!r}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must be in [0, N), got {value!r}")
+    return index, count
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the causal / code-repair agents over a dataset.")
+    parser.add_argument("--input", default=INPUT_PATH, help="questions file (.json or .jsonl)")
+    parser.add_argument("--output", default=None,
+                        help=f"where to write the answers (default: {OUTPUT_PATH}, or output.shard-i-of-N.json with --shard)")
+    parser.add_argument("--columnar", default=None,
+                        help="columnar zstd JSONL result file (default: <output>.jsonl.zst)")
+    parser.add_argument("--shard", type=parse_shard, default=None, metavar="i/N",
+                        help="only run tasks whose task_id hashes to shard i of N (0-based)")
+    parser.add_argument("--max-in-flight", type=int, default=0,
+                        help="most tasks queued or running at once (default: twice --chunk-size)")
+    parser.add_argument("--chunk-size", type=int, default=256,
+                        help="tasks read from the input stream and prepared (embedding, cache lookups) at a time")
+    parser.add_argument("--merge", nargs="+", metavar="SHARD_OUTPUT",
+                        help="merge per-shard outputs into --output in input order, then exit")
+    parser.add_argument("--repair-workers", type=int, default=1,
+                        help="concurrent requests to the local Ollama repair planner")
+    parser.add_argument("--causal-workers", type=int, default=4,
+                        help="concurrent runs of the Groq-hosted causal graph")
+    parser.add_argument("--repair-rate", type=float, default=0.0,
+                        help="max repair requests started per second (0 = unlimited)")
+    parser.add_argument("--causal-rate", type=float, default=0.0,
+                        help="max causal tasks started per second (0 = unlimited)")
+    parser.add_argument("--checkpoint", default=None,
+                        help="JSONL file answers are appended to as they finish (default: <output>.checkpoint.jsonl)")
+    parser.add_argument("--fsync", choices=FSYNC_POLICIES, default="batch",
+                        help="when to fsync the checkpoint: every record, every --fsync-every records, or never")
+    parser.add_argument("--fsync-every", type=int, default=20)
+    parser.add_argument("--restart", action="store_true",
+                        help="ignore an existing checkpoint instead of resuming from it")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="bypass the on-disk repair-planner completion cache")
+    parser.add_argument("--semantic-cache", action="store_true",
+                        help="reuse stored answers for near-duplicate causal questions instead of running the graph")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="print how long each deferred import / lazy resource took to load")
+    parser.add_argument("--embed-batch-size", type=int, default=32,
+                        help="embed causal questions up front in batches of this size (0 = embed one by one in the graph)")
+    parser.add_argument("--metrics-json", default=None,
+                        help="write per-task / per-node timing, token and tool-loop metrics as JSON")
+    parser.add_argument("--metrics-prom", default=None,
+                        help="write aggregate metrics in Prometheus text format")
+    add_profile_args(parser)
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    print("Building agents.")
-    default_agent = build_default_agent()
-    repair_agent  = repair_engine.build_graph()
+    args = parse_args()
+    if args.no_cache:
+        repair_engine.completion_cache.bypass = True
+    # per-task metrics are only written by --metrics-json; otherwise finished tasks are just aggregated
+    recorder.keep_per_task = bool(args.metrics_json)
 
-    print(f"Loading questions from {INPUT_PATH}.")
-    entries = load_questions(INPUT_PATH)
-    print(f"Running agent on {len(entries)} questions.")
+    if args.output is None:
+        args.output = f"output.shard-{args.shard[0]}-of-{args.shard[1]}.json" if args.shard else OUTPUT_PATH
 
-    # Load a few-shot library of repair examples
-    examples = []
-    with open("bug_data/repair_example.jsonl", encoding="utf-8") as f:
-        for line in f:
-            record = json.loads(line)
-            if record.get("type") == "code_repair":
-                examples.append(record)
+    if args.merge:
+        written = merge_outputs(args.merge, args.input, args.output)
+        print(f"Merged {len(args.merge)} shard outputs into {args.output} ({written} answers)")
+        raise SystemExit(0)
 
-    # with open("repair_example.jsonl", encoding="utf-8") as f:
-    #     examples = [json.loads(line) for line in f if line.get("type") == "code_repair"]
+    # size the repair planner's connection pool to the repair concurrency
+    repair_engine.OLLAMA_POOL_SIZE = max(repair_engine.OLLAMA_POOL_SIZE, args.repair_workers)
 
-    results = []
-    for item in entries:
-        task_id = item.get("task_id", "")
-        q_type  = item.get("type", "")
-        question = item.get("Question") or item.get("question")
-        # decide branch
-        if q_type == "code_repair":
-            # code-repair path
-            code   = item.get("code", "")
-            patch  = generate_code_patch(
-                question=question,
-                code=code,
-                examples=examples
-            )
-            submitted = patch
-        else:
-            # default (causal) path
-            msgs = [HumanMessage(content=question)]
-            out  = default_agent.invoke({"messages": msgs})
-            text = out["messages"][-1].content
-            submitted = text.removeprefix("FINAL ANSWER: ").strip()
-
-        results.append({
-            "task_id": task_id,
-            "submitted_answer": submitted
-        })
+    checkpoint = args.checkpoint or checkpoint_path_for(args.output)
+    if args.restart and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    done = load_completed(checkpoint)
+    if done:
+        print(f"Resuming from {checkpoint}: {len(done)} tasks already finished.")
 
-    print(f"Saving answers to {OUTPUT_PATH}.")
-    save_results(results, OUTPUT_PATH)
+    shard_note = f" (shard {args.shard[0]}/{args.shard[1]})" if args.shard else ""
+    print(f"Streaming questions from {args.input}{shard_note}.")
+    default_agent = None
+    examples = repair_engine.get_examples()
+    seen = 0
+    profiler = profiler_from_args(args)
+    runner = TaskRunner(
+        examples,
+        repair_workers=args.repair_workers,
+        causal_workers=args.causal_workers,
+        repair_rate=args.repair_rate,
+        causal_rate=args.causal_rate,
+        max_in_flight=args.max_in_flight or 2 * args.chunk_size,
+        profiler=profiler,
+    )
+    with CheckpointWriter(checkpoint, fsync=args.fsync, fsync_every=args.fsync_every) as writer, runner:
+        for chunk in chunked(iter_questions(args.input, args.shard), args.chunk_size):
+            seen += len(chunk)
+            pending = [item for item in chunk if item.get("task_id", "") not in done]
 
-    print("All done.")
+            # The causal graph (embedding model, Supabase, Groq) is only built once a causal task shows up
+            similar_docs = {}
+            sink = writer.write
+            causal_items = [item for item in pending if item.get("type", "") != "code_repair"]
+            if causal_items:
+                if default_agent is None:
+                    print("Building causal agent.")
+                    with timed("import causal_analyzer"):
+                        from causal_analyzer import (
+                            build_graph as build_default_agent, embed_questions, get_answer_cache, search_similar,
+                        )
+                    default_agent = runner.default_agent = build_default_agent()
+                answer_cache = get_answer_cache() if args.semantic_cache else None
+                if answer_cache is not None or args.embed_batch_size > 0:
+                    questions = [item.get("question") or item.get("Question") for item in causal_items]
+                    vectors = embed_questions(questions, batch_size=max(1, args.embed_batch_size))
+                    if answer_cache is not None:
+                        misses, sink = answer_from_cache(answer_cache, causal_items, questions, vectors, writer.write)
+                        missed = {item.get("task_id", "") for item, _, _ in misses}
+                        pending = [item for item in pending
+                                   if item.get("type", "") == "code_repair" or item.get("task_id", "") in missed]
+                        causal_items = [item for item, _, _ in misses]
+                        questions = [question for _, question, _ in misses]
+                        vectors = [vector for _, _, vector in misses]
+                    if args.embed_batch_size > 0 and causal_items:
+                        neighbours = search_similar(questions, batch_size=args.embed_batch_size, vectors=vectors)
+                        similar_docs = {item.get("task_id", ""): docs for item, docs in zip(causal_items, neighbours)}
+
+            # blocks only while the in-flight window is full, not until the whole chunk is done
+            for item in pending:
+                runner.submit(item, sink, similar_docs.get(item.get("task_id", "")))
+            if default_agent is not None and args.semantic_cache:
+                # persist what has been answered so far
+                get_answer_cache().save()
+            print(f"Scheduled {seen} questions.")
+    if default_agent is not None and args.semantic_cache:
+        get_answer_cache().save()
+
+    print(f"Saving answers to {args.output}.")
+    task_ids = (item.get("task_id", "") for item in iter_questions(args.input, args.shard))
+    written = finalize(checkpoint, args.output, task_ids)
+    print(f"Results saved to: {args.output} ({written} answers)")
+    columnar = args.columnar or columnar_path_for(args.output)
+    task_ids = (item.get("task_id", "") for item in iter_questions(args.input, args.shard))
+    written = write_columnar(iter_final_records(checkpoint, task_ids), columnar)
+    print(f"Columnar results saved to: {columnar} ({written} rows)")
+    # both outputs are written: the next run must not take this run's answers as already done
+    print(f"Checkpoint moved to {retire(checkpoint)}.")
 
+    stats = repair_engine.completion_cache.stats()
+    print(f"Repair cache: {stats['hits']} hits, {stats['misses']} misses, "
+          f"{stats['entries']} entries ({stats['bytes'] / 1e6:.1f} MB)")
+    if default_agent is not None and args.semantic_cache:
+        stats = get_answer_cache().stats()
+        print(f"Semantic answer cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries")
+    stats = tool_cache.stats()
+    print(f"Tool cache ({stats['mode']}): {stats['hits']} hits, {stats['misses']} misses, "
+          f"{stats['coalesced']} coalesced")
+
+    if args.metrics_json:
+        recorder.to_json(args.metrics_json)
+        print(f"Metrics saved to {args.metrics_json}")
+    if args.metrics_prom:
+        recorder.to_prometheus_file(args.metrics_prom)
+        print(f"Prometheus metrics saved to {args.metrics_prom}")
+
+    if args.startup_report:
+        print(startup_report())
+
+    if profiler is not None:
+        profiler.stop()
+        profiler.write_report()
+        print(profiler.summary())
+        print(f"Profile saved to {profiler.report_path} (ledger: {profiler.ledger_path})")
+
+    print("All done.")
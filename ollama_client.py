@@ -0,0 +1,101 @@
+"""
+Minimal client for Ollama's native /api/chat endpoint, shared by every repair request.
+
+One requests.Session holds a keep-alive connection pool sized to the repair concurrency.
+Requests beyond the pool wait in a bounded local queue; when that is full too, callers block
+(backpressure) for up to queue_timeout before OllamaQueueFull is raised. Connection errors,
+timeouts, 429 and 5xx responses are retried with full-jitter exponential backoff as long as no
+response body has been consumed yet.
+"""
+import json
+import time
+import random
+import threading
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class OllamaError(RuntimeError):
+    pass
+
+
+class OllamaQueueFull(OllamaError):
+    pass
+
+
+class OllamaClient:
+    def __init__(self, base_url: str, pool_size: int = 4, max_queue: int = 64,
+                 connect_timeout: float = 5.0, read_timeout: float = 300.0,
+                 max_retries: int = 3, backoff: float = 0.5, queue_timeout: float = 600.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.queue_timeout = queue_timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # in flight + waiting, and in flight only
+        self._admission = threading.BoundedSemaphore(pool_size + max_queue)
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    @contextmanager
+    def _slot(self):
+        if not self._admission.acquire(timeout=self.queue_timeout):
+            raise OllamaQueueFull(f"repair request queue full for {self.queue_timeout:.0f}s")
+        try:
+            with self._slots:
+                yield
+        finally:
+            self._admission.release()
+
+    def _sleep_before_retry(self, attempt: int):
+        time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def _post(self, path: str, payload: dict, stream: bool) -> requests.Response:
+        """POST with retries; returns a response with a 2xx status (body not yet read when streaming)."""
+        url = self.base_url + path
+        for attempt in range(self.max_retries + 1):
+            last = attempt == self.max_retries
+            try:
+                resp = self.session.post(url, json=payload, stream=stream, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if last:
+                    raise OllamaError(f"POST {path} failed: {e}") from e
+                self._sleep_before_retry(attempt)
+                continue
+            if resp.status_code < 400:
+                return resp
+            body = resp.text[:500]
+            resp.close()
+            if last or resp.status_code not in RETRY_STATUSES:
+                raise OllamaError(f"POST {path} returned {resp.status_code}: {body}")
+            self._sleep_before_retry(attempt)
+
+    def chat(self, payload: dict) -> dict:
+        """Non-streaming /api/chat; returns the final response object."""
+        with self._slot():
+            resp = self._post("/api/chat", {**payload, "stream": False}, stream=False)
+            return resp.json()
+
+    def chat_stream(self, payload: dict):
+        """
+        Streaming /api/chat; yields the parsed NDJSON chunks. Closing the generator early
+        (break / close()) hangs up the connection, which makes Ollama stop generating.
+        """
+        with self._slot():
+            resp = self._post("/api/chat", {**payload, "stream": True}, stream=True)
+            try:
+                for line in resp.iter_lines():
+                    if line:
+                        yield json.loads(line)
+            finally:
+                resp.close()
+
+    def close(self):
+        self.session.close()
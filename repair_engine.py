@@ -1,51 +1,101 @@
+import os
 import json
-from smolagents import LiteLLMModel
+import time
 from langchain_core.messages import HumanMessage, AIMessage
+from disk_cache import DiskCache, request_key
+from startup import lazy_resource
+from instrumentation import CHARS_PER_TOKEN, recorder, timed_call
+from example_index import ExampleIndex
+from ollama_client import OllamaClient
 
-repair_planner = LiteLLMModel(
-    llm_provider="ollama",
-    model_id="ollama/deepseek-coder-v2:16b",
-    api_base="http://localhost:11434",
-    api_key="ollama"
+REPAIR_MODEL = "ollama/deepseek-coder-v2:16b"
+OLLAMA_API_BASE = os.environ.get("OLLAMA_API_BASE", "http://localhost:11434")
+# few-shot selection: at most FEWSHOT_MAX_EXAMPLES examples, together within FEWSHOT_TOKEN_BUDGET tokens
+FEWSHOT_MAX_EXAMPLES = int(os.environ.get("FEWSHOT_MAX_EXAMPLES", "2"))
+FEWSHOT_TOKEN_BUDGET = int(os.environ.get("FEWSHOT_TOKEN_BUDGET", "256"))
+# Streaming mode stops generation at the end of the patched-code fence, plus up to
+# REPAIR_EXPLANATION_TOKENS tokens of explanation. REPAIR_STREAM=0 waits for the full completion.
+REPAIR_STREAM = os.environ.get("REPAIR_STREAM", "1") not in ("", "0")
+REPAIR_EXPLANATION_TOKENS = int(os.environ.get("REPAIR_EXPLANATION_TOKENS", "0"))
+
+# Fixed instruction header. It must stay byte-identical across tasks so Ollama can reuse
+# the cached prompt prefix.
+REPAIR_HEADER = "\n".join([
+    "You are a multi-language code repair assistant (Java, Python, C++, etc.).",
+    "For each “Fix the following buggy XXX function.” prompt and its code snippet,",
+    "output:\n  1) A complete, compilable patched version in the same language,\n",
+    "  2) A brief explanation of your changes.",
+    "",
+])
+
+# Transport for the repair planner: keep-alive pool of OLLAMA_POOL_SIZE connections (main.py raises it
+# to --repair-workers), at most OLLAMA_MAX_QUEUE requests waiting behind them, and per-request timeouts/retries.
+OLLAMA_POOL_SIZE = int(os.environ.get("OLLAMA_POOL_SIZE", "4"))
+OLLAMA_MAX_QUEUE = int(os.environ.get("OLLAMA_MAX_QUEUE", "64"))
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_READ_TIMEOUT = float(os.environ.get("OLLAMA_READ_TIMEOUT", "300"))
+OLLAMA_MAX_RETRIES = int(os.environ.get("OLLAMA_MAX_RETRIES", "3"))
+
+@lazy_resource("repair planner")
+def get_repair_client() -> OllamaClient:
+    return OllamaClient(
+        OLLAMA_API_BASE,
+        pool_size=OLLAMA_POOL_SIZE,
+        max_queue=OLLAMA_MAX_QUEUE,
+        connect_timeout=OLLAMA_CONNECT_TIMEOUT,
+        read_timeout=OLLAMA_READ_TIMEOUT,
+        max_retries=OLLAMA_MAX_RETRIES,
+    )
+
+def ollama_payload(request: dict) -> dict:
+    """Translate the (cache-keyed) request into a native /api/chat body."""
+    return {
+        "model": request["model"].removeprefix("ollama/"),
+        "messages": request["messages"],
+        "options": {
+            "num_predict": request["max_tokens"],
+            "temperature": request["temperature"],
+            "top_p": request["top_p"],
+            "seed": request["seed"],
+        },
+    }
+
+# Completions are deterministic (temperature=0, seed=0), so identical requests are served from disk.
+# REPAIR_CACHE_BYPASS=1 forces every request through to Ollama.
+completion_cache = DiskCache(
+    os.environ.get("REPAIR_CACHE_PATH", ".cache/repair_completions.sqlite"),
+    max_bytes=int(os.environ.get("REPAIR_CACHE_MAX_MB", "256")) * 1024 * 1024,
+    bypass=os.environ.get("REPAIR_CACHE_BYPASS", "") not in ("", "0"),
 )
 
-# Load a handful of few-shot examples for code repair
-# load few-shot examples for code repair
-examples = []
-with open("bug_data/repair_example.jsonl", encoding="utf-8") as f:
-    for line in f:
-        record = json.loads(line)
-        if record.get("type") == "code_repair":
-            examples.append(record)
+@lazy_resource("repair examples")
+def get_examples() -> list[dict]:
+    """Load the few-shot library of code-repair examples (read once, on first use)."""
+    examples = []
+    with open("bug_data/repair_example.jsonl", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get("type") == "code_repair":
+                examples.append(record)
+    return examples
+
+@lazy_resource("repair example index")
+def get_example_index() -> ExampleIndex:
+    return ExampleIndex(get_examples())
 
 def build_repair_prompt(question: str, code: str, examples: list[dict]) -> str:
     """
     Construct a few-shot prompt for the repair planner:
-    - Show 2–3 examples of Question+code → Final answer
-    - Then present the real Question and code
+    - The fixed instruction header
+    - The examples most similar to `code` that fit FEWSHOT_TOKEN_BUDGET (Question+code → Final answer)
+    - Then the real Question and code
     - Instruct the model to output full patched code plus a brief explanation.
     """
-    # Take the first 2 examples
-    few = examples[:3]
-    parts = [
-        "You are a multi-language code repair assistant (Java, Python, C++, etc.).",
-        "For each “Fix the following buggy XXX function.” prompt and its code snippet,",
-        "output:\n  1) A complete, compilable patched version in the same language,\n",
-        "  2) A brief explanation of your changes.",
-        ""
-    ]
+    index = get_example_index() if examples is get_examples() else ExampleIndex(examples)
+    chosen = index.select(code, FEWSHOT_MAX_EXAMPLES, FEWSHOT_TOKEN_BUDGET)
+    parts = [REPAIR_HEADER]
     # Insert few-shot examples
-    for ex in few:
-        parts.append("### Example")
-        parts.append(f"Q: {ex['Question']}")
-        parts.append("```<auto-detect>")
-        parts.append(ex["code"])
-        parts.append("```")
-        parts.append("Patched code:")
-        parts.append("```java")  # or the language tag of that example
-        parts.append(ex["Final answer"])
-        parts.append("```")
-        parts.append("")
+    parts.extend(index.blocks[i] for i in chosen)
     # Now the real task
     parts.append("### Now please repair this:")
     parts.append(f"Q: {question}")
@@ -60,25 +110,136 @@ def build_repair_prompt(question: str, code: str, examples: list[dict]) -> str:
     parts.append("- …")
     return "\n".join(parts)
 
+class PatchStream:
+    """
+    Incremental parser for a repair answer: finds the first ``` fence, then its closing fence,
+    then counts explanation tokens. `done` turns true once nothing more is wanted.
+    """
+    def __init__(self, explanation_tokens: int = 0):
+        self.explanation_tokens = explanation_tokens
+        self.text = ""
+        self.code_start = None  # index just after the opening fence line
+        self.code_end = None    # index of the closing fence
+        self.explanation_seen = 0
+
+    def feed(self, piece: str):
+        self.text += piece
+        if self.code_end is not None:
+            self.explanation_seen += 1
+            return
+        if self.code_start is None:
+            fence = self.text.find("```")
+            newline = self.text.find("\n", fence) if fence >= 0 else -1
+            if newline < 0:
+                return
+            self.code_start = newline + 1
+        close = self.text.find("```", self.code_start)
+        if close >= 0:
+            self.code_end = close
+
+    @property
+    def done(self) -> bool:
+        return self.code_end is not None and self.explanation_seen >= self.explanation_tokens
+
+    def result(self) -> str:
+        """Text to return: everything up to the closing fence (plus any explanation kept)."""
+        if self.code_end is None:
+            return self.text
+        if self.explanation_tokens <= 0:
+            return self.text[:self.code_end + 3]
+        return self.text
+
+def split_patch(text: str) -> dict:
+    """Structured view of a repair answer: {"text", "code", "explanation"}."""
+    parser = PatchStream()
+    parser.feed(text)
+    if parser.code_end is None:
+        return {"text": text, "code": text.strip(), "explanation": ""}
+    explanation = text[parser.code_end + 3:].strip()
+    explanation = explanation.removeprefix("Explanation:").strip()
+    return {"text": text, "code": text[parser.code_start:parser.code_end].strip(), "explanation": explanation}
+
+def _stream_completion(request: dict, explanation_tokens: int) -> tuple[str, int, int]:
+    """
+    Stream a completion and hang up once PatchStream is done. Returns (text, prompt_tokens, completion_tokens);
+    after an early stop both counts are client-side estimates.
+    """
+    chunks = get_repair_client().chat_stream(ollama_payload(request))
+    parser = PatchStream(explanation_tokens)
+    pieces, final = 0, {}
+    try:
+        for chunk in chunks:
+            if chunk.get("done"):
+                final = chunk
+                break
+            piece = chunk.get("message", {}).get("content", "")
+            if not piece:
+                continue
+            pieces += 1
+            parser.feed(piece)
+            if parser.done:
+                break
+    finally:
+        # closing the response aborts generation on the Ollama side
+        chunks.close()
+    if "prompt_eval_count" in final:
+        prompt_tokens = final["prompt_eval_count"]
+    else:
+        # Ollama only counts the prompt in the final chunk, which an early stop never reads
+        prompt_tokens = sum(len(m["content"]) for m in request["messages"]) // CHARS_PER_TOKEN
+    return parser.result(), prompt_tokens, final.get("eval_count", pieces)
+
+def complete(prompt: str, max_tokens: int = 2048, stream: bool = None, explanation_tokens: int = None) -> str:
+    """
+    Send one prompt to the repair planner, going through the completion cache.
+    The cache key covers every field that can change the output.
+    With stream=True (default REPAIR_STREAM) generation stops after the patched-code fence
+    and `explanation_tokens` further tokens.
+    """
+    stream = REPAIR_STREAM if stream is None else stream
+    explanation_tokens = REPAIR_EXPLANATION_TOKENS if explanation_tokens is None else explanation_tokens
+    request = {
+        "model": REPAIR_MODEL,
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": max_tokens,
+        "temperature": 0.0,
+        "top_p": 1.0,
+        "seed": 0,
+    }
+    start = time.perf_counter()
+    key = request_key({**request, "stop_after_fence": explanation_tokens} if stream else request)
+    cached = completion_cache.get(key)
+    if cached is not None:
+        recorder.record_node("repair_planner", time.perf_counter() - start, cache_hit=True)
+        return cached.decode("utf-8")
+
+    if stream:
+        content, prompt_tokens, completion_tokens = _stream_completion(request, explanation_tokens)
+    else:
+        resp = get_repair_client().chat(ollama_payload(request))
+        content = resp["message"]["content"]
+        prompt_tokens = resp.get("prompt_eval_count", 0)
+        completion_tokens = resp.get("eval_count", 0)
+    recorder.record_node(
+        "repair_planner", time.perf_counter() - start,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+    )
+    completion_cache.set(key, content.encode("utf-8"))
+    return content
+
+@timed_call("generate_code_patch")
 def generate_code_patch(question: str, code: str, examples: list[dict]) -> str:
     """
     Build the prompt and call the repair planner.
     """
     prompt = build_repair_prompt(question, code, examples)
-    resp = repair_planner.client.completion(
-        model="ollama/deepseek-coder-v2:16b",
-        provider="ollama",
-        api_base="http://localhost:11434",
-        api_key="ollama",
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=2048,
-        temperature=0.0,
-        top_p=1.0,
-        seed=0,
-        stream=False,
-    )
-    # Return the full content (patched code + explanation)
-    return resp.choices[0].message.content
+    # Return the full content (patched code + any explanation)
+    return complete(prompt, max_tokens=2048)
+
+def generate_patch_fields(question: str, code: str, examples: list[dict]) -> dict:
+    """Like generate_code_patch, but returns {"text", "code", "explanation"}."""
+    return split_patch(generate_code_patch(question, code, examples))
 
 def build_graph():
     """
@@ -91,6 +252,7 @@ def build_graph():
         def __init__(self, max_tokens: int = 2048):
             self.max_tokens = max_tokens
 
+        @timed_call("repair_agent")
         def invoke(self, inputs: dict) -> dict:
             # 1) extract the raw prompt
             msgs = inputs.get("messages", [])
@@ -99,22 +261,14 @@ def build_graph():
             prompt = msgs[0].content
 
             # 2) here, we assume `prompt` already contains the Question + code + few-shot examples
-            #    so we just send it to the planner
-            resp = repair_planner.client.completion(
-                model="ollama/deepseek-coder-v2:16b",
-                provider="ollama",
-                api_base="http://localhost:11434",
-                api_key="ollama",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=self.max_tokens,
-                temperature=0.0,
-                top_p=1.0,
-                seed=0,
-                stream=False,
-            )
-            patched = resp.choices[0].message.content
-
-            # 3) wrap in an AIMessage so it matches the agent API
-            return {"messages": [AIMessage(content=patched)]}
+            #    so we just send it to the planner (through the completion cache)
+            patched = complete(prompt, max_tokens=self.max_tokens)
+
+            # 3) wrap in an AIMessage so it matches the agent API; code/explanation ride along as metadata
+            fields = split_patch(patched)
+            message = AIMessage(content=patched, additional_kwargs={
+                "code": fields["code"], "explanation": fields["explanation"],
+            })
+            return {"messages": [message]}
 
     return RepairAgent()
\ No newline at end of file
@@ -0,0 +1,117 @@
+"""
+Semantic answer cache for causal questions.
+
+Questions are stored as unit-normalized embedding rows in one .npz file, next to a JSON document
+holding each row's question, answer, source task_id and LRU tick. Both go into the same file
+(written to a temp file and renamed), so a crash can never pair vectors with another save's answers.
+A lookup is one matrix-vector product; a hit is the nearest row with cosine >= threshold.
+When full, the least recently used row is overwritten.
+"""
+import os
+import json
+import threading
+import numpy as np
+
+
+class SemanticAnswerCache:
+    def __init__(self, path: str, threshold: float = 0.92, capacity: int = 10000):
+        self.path = path
+        self.threshold = threshold
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._vectors = None   # (capacity, dim) float32, rows [0, len(entries)) in use
+        self._entries = []
+        self._clock = 0
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with np.load(self.path, allow_pickle=False) as data:
+            vectors = data["vectors"]
+            meta = json.loads(data["meta"].tobytes().decode("utf-8"))
+        entries = meta["entries"]
+        if len(entries) != len(vectors):
+            return  # not written by save(): start empty rather than serve mismatched answers
+        # keep the most recently used rows if the capacity shrank
+        keep = sorted(range(len(entries)), key=lambda i: -entries[i]["last_used"])[:self.capacity]
+        keep.sort()
+        self._allocate(vectors.shape[1])
+        self._vectors[:len(keep)] = vectors[keep]
+        self._entries = [entries[i] for i in keep]
+        self._clock = meta.get("clock", 0)
+
+    def _allocate(self, dim: int):
+        self._vectors = np.zeros((self.capacity, dim), dtype=np.float32)
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, vector):
+        """Return {"answer", "source_task_id", "question", "similarity"} for a hit, else None."""
+        query = self._normalize(vector)
+        with self._lock:
+            if not self._entries:
+                self.misses += 1
+                return None
+            scores = self._vectors[:len(self._entries)] @ query
+            best = int(np.argmax(scores))
+            similarity = float(scores[best])
+            if similarity < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._clock += 1
+            entry = self._entries[best]
+            entry["last_used"] = self._clock
+            self._dirty = True
+            return {
+                "answer": entry["answer"],
+                "source_task_id": entry["task_id"],
+                "question": entry["question"],
+                "similarity": round(similarity, 4),
+            }
+
+    def add(self, vector, question: str, answer: str, task_id: str):
+        row_vector = self._normalize(vector)
+        with self._lock:
+            if self._vectors is None:
+                self._allocate(row_vector.shape[0])
+            self._clock += 1
+            entry = {"question": question, "answer": answer, "task_id": task_id, "last_used": self._clock}
+            if len(self._entries) < self.capacity:
+                row = len(self._entries)
+                self._entries.append(entry)
+            else:
+                row = min(range(len(self._entries)), key=lambda i: self._entries[i]["last_used"])
+                self._entries[row] = entry
+            self._vectors[row] = row_vector
+            self._dirty = True
+
+    def save(self):
+        """Write vectors and entries to one file (via a temp file + rename) if anything changed."""
+        with self._lock:
+            if not self._dirty or self._vectors is None:
+                return
+            vectors = self._vectors[:len(self._entries)].copy()
+            meta = {"clock": self._clock, "entries": [dict(e) for e in self._entries]}
+            self._dirty = False
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        meta_bytes = np.frombuffer(json.dumps(meta, ensure_ascii=False).encode("utf-8"), dtype=np.uint8)
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, vectors=vectors, meta=meta_bytes)
+        os.replace(tmp, self.path)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
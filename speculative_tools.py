@@ -0,0 +1,75 @@
+"""
+Speculative tool prefetch for the causal graph.
+
+While the first assistant call is in flight, likely tool queries (the question itself and a
+keyword query built from it) are already sent to the search tools. When the model then issues
+a tool call whose query is close enough to a prefetched one, the tools node takes that result
+instead of starting a new search. Whatever was not used is cancelled or thrown away.
+"""
+import re
+from context_compaction import keywords
+from tool_cache import normalize_query
+
+_WORD = re.compile(r"[a-z0-9]+")
+# longest speculative query, in characters (full questions can carry long context)
+MAX_QUERY_CHARS = 300
+
+
+class Speculation:
+    """One background tool call started before the model asked for it."""
+    def __init__(self, tool_name: str, query: str, future):
+        self.tool_name = tool_name
+        self.query = query
+        self.future = future
+        self.terms = keywords(query)
+        self.used = False
+
+
+def speculative_queries(question: str, example: str = "", max_terms: int = 8) -> list[str]:
+    """
+    Likely tool queries for a question: the question itself, and its keywords in order with the
+    ones it shares with the retrieved example first (those tend to be the topic words).
+    """
+    question = " ".join(question.split())[:MAX_QUERY_CHARS]
+    terms = keywords(question)
+    example_terms = keywords(example)
+    ordered = [w for w in dict.fromkeys(_WORD.findall(question.lower())) if w in terms]
+    ordered.sort(key=lambda w: w not in example_terms)
+    queries = [question, " ".join(ordered[:max_terms])]
+    seen, unique = set(), []
+    for query in queries:
+        key = normalize_query(query)
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(query)
+    return unique
+
+
+def similarity(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def match_speculation(speculations, tool_name: str, query: str, threshold: float):
+    """The unused prefetch for `tool_name` closest to `query`, if its keyword Jaccard is >= threshold."""
+    terms = keywords(query)
+    best, best_score = None, threshold
+    for spec in speculations:
+        if spec.used or spec.tool_name != tool_name:
+            continue
+        score = 1.0 if normalize_query(spec.query) == normalize_query(query) else similarity(spec.terms, terms)
+        if score >= best_score:
+            best, best_score = spec, score
+    if best is not None:
+        best.used = True
+    return best
+
+
+def discard_speculations(speculations) -> int:
+    """Cancel prefetches nobody used (running ones finish in the background and are ignored)."""
+    discarded = 0
+    for spec in speculations:
+        if not spec.used:
+            spec.future.cancel()
+            spec.used = True
+            discarded += 1
+    return discarded
@@ -0,0 +1,55 @@
+import time
+import functools
+import threading
+from contextlib import contextmanager
+
+# name -> seconds spent creating a lazy resource or importing a module
+STARTUP_TIMINGS = {}
+
+
+def record(name: str, seconds: float):
+    STARTUP_TIMINGS[name] = STARTUP_TIMINGS.get(name, 0.0) + seconds
+
+
+@contextmanager
+def timed(name: str):
+    """Time a block (typically a deferred import) and add it to the startup report."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def lazy_resource(name: str):
+    """
+    Turn a zero-argument factory into a memoized getter. The factory runs on first use only,
+    under a lock so concurrent workers don't build the same resource twice, and its cost is recorded.
+    """
+    def decorator(factory):
+        lock = threading.Lock()
+        slot = []
+
+        @functools.wraps(factory)
+        def getter():
+            if not slot:
+                with lock:
+                    if not slot:
+                        with timed(name):
+                            slot.append(factory())
+            return slot[0]
+
+        getter.is_loaded = lambda: bool(slot)
+        return getter
+    return decorator
+
+
+def startup_report() -> str:
+    if not STARTUP_TIMINGS:
+        return "Startup: no lazy resources were loaded."
+    width = max(len(name) for name in STARTUP_TIMINGS)
+    lines = ["Startup cost (seconds):"]
+    for name, seconds in sorted(STARTUP_TIMINGS.items(), key=lambda kv: -kv[1]):
+        lines.append(f"  {name:<{width}}  {seconds:8.3f}")
+    lines.append(f"  {'total':<{width}}  {sum(STARTUP_TIMINGS.values()):8.3f}")
+    return "\n".join(lines)
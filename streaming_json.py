@@ -0,0 +1,77 @@
+import json
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\r\n"
+_DELIMITERS = _WHITESPACE + ",]"
+
+
+def iter_json_array(f, chunk_size: int = 1 << 16):
+    """
+    Yield the elements of a top-level JSON array one at a time from a text file object,
+    reading it in chunks so memory stays proportional to the largest element, not the file.
+    """
+    buf = ""
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    def skip_ws():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            fill()
+
+    skip_ws()
+    if pos >= len(buf) or buf[pos] != "[":
+        raise ValueError("expected a JSON array")
+    pos += 1
+    skip_ws()
+    if pos < len(buf) and buf[pos] == "]":
+        return
+
+    while True:
+        skip_ws()
+        try:
+            value, end = _decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            fill()
+            continue
+        # a value is only complete once a delimiter follows it: a number cut at the chunk
+        # boundary ("1." / "1.5e" / "-") decodes as a shorter number or not at all
+        if not eof and (end == len(buf) or buf[end] not in _DELIMITERS):
+            fill()
+            continue
+        pos = end
+        yield value
+
+        skip_ws()
+        if pos >= len(buf):
+            raise ValueError("unterminated JSON array")
+        if buf[pos] == "]":
+            return
+        if buf[pos] != ",":
+            raise ValueError(f"expected ',' or ']' in JSON array, got {buf[pos]!r}")
+        pos += 1
+
+
+def iter_records(path: str):
+    """Yield records from a .jsonl file (line by line) or a .json array (incrementally)."""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from iter_json_array(f)
@@ -0,0 +1,268 @@
+"""
+Per-task profiling for main.py and debug_evaluate.py (--profile).
+
+A sampling thread wakes every `interval` seconds, grabs the stack of every thread that is
+working on a task (threads announce themselves through instrumentation.task_threads) and counts
+it against that task. With memory=True (--profile-memory) it also reads tracemalloc's peak since
+the previous tick and charges it to every task running in that window. With concurrent tasks the
+memory figure is therefore an upper bound; with one worker it is exact.
+
+cpu_s is the CPU time of the task's own thread plus that of the helper threads marked with the
+task (graph nodes, tool calls); background work nobody marks, such as HTTP client internals or a
+prefetch still running after the task ended, is not included.
+
+Every finished task appends one line to the ledger (<report>.ledger.jsonl):
+  task_id, wall_s, cpu_s, peak_mb, samples, outlier flags
+Only the top-N slowest and largest tasks keep their dominant stacks (and, for memory outliers,
+the top allocation sites); they go to the report JSON together with the outlier ids.
+
+tracemalloc hooks every allocation even with a single frame recorded and can slow allocation-heavy
+code (AST parsing) several times, so memory tracking is off unless asked for. Stack sampling alone
+costs little.
+"""
+import os
+import sys
+import json
+import time
+import heapq
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from instrumentation import pop_helper_cpu, task_threads, watch_helper_cpu
+
+MB = 1024 * 1024
+
+
+def ledger_path_for(report_path: str) -> str:
+    """profile_report.json -> profile_report.ledger.jsonl"""
+    return os.path.splitext(report_path)[0] + ".ledger.jsonl"
+
+
+def format_stack(frame, depth: int) -> str:
+    """Innermost `depth` frames as 'file:line func' joined by ' <- '."""
+    parts = []
+    while frame is not None and len(parts) < depth:
+        code = frame.f_code
+        parts.append(f"{os.path.basename(code.co_filename)}:{frame.f_lineno} {code.co_name}")
+        frame = frame.f_back
+    return " <- ".join(parts)
+
+
+class _Running:
+    def __init__(self, baseline: int):
+        self.start = time.perf_counter()
+        self.cpu_start = time.thread_time()
+        self.baseline = baseline
+        self.peak = baseline
+        self.stacks = Counter()
+
+
+class TaskProfiler:
+    def __init__(self, report_path: str = None, interval: float = 0.01,
+                 slow_s: float = 60.0, memory_mb: float = 256.0, top_n: int = 10,
+                 stack_depth: int = 12, memory: bool = False):
+        self.report_path = report_path
+        self.ledger_path = ledger_path_for(report_path) if report_path else None
+        self.interval = interval
+        self.slow_s = slow_s
+        self.memory_mb = memory_mb
+        self.top_n = top_n
+        self.stack_depth = stack_depth
+        self.memory = memory
+        self.tasks = 0
+        self.outliers = []
+        self._slowest = []   # min-heaps of (key, seq, entry)
+        self._largest = []
+        self._seq = 0
+        self._running = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._ledger = None
+
+    # lifecycle
+
+    def start(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start(1)
+        if self.ledger_path:
+            self._ledger = open(self.ledger_path, "w", encoding="utf-8")
+        self._thread = threading.Thread(target=self._sample_loop, name="task-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._ledger is not None:
+            self._ledger.close()
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # sampling
+
+    def _poll_memory(self):
+        """Charge tracemalloc's peak since the last poll to every running task (call with the lock held)."""
+        if not self.memory or not tracemalloc.is_tracing():
+            return 0
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        for running in self._running.values():
+            running.peak = max(running.peak, peak)
+        return current
+
+    def _sample_loop(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                self._poll_memory()
+                for thread_id, task_id in list(task_threads.items()):
+                    running = self._running.get(task_id)
+                    frame = frames.get(thread_id)
+                    if running is None or frame is None or thread_id == own:
+                        continue
+                    running.stacks[format_stack(frame, self.stack_depth)] += 1
+
+    # tasks
+
+    @contextmanager
+    def task(self, task_id: str, sink=None, **info):
+        """
+        Profile one task; the calling thread must be inside instrumentation.task_context(task_id).
+        The finished entry goes to add_entry(), or to `sink` (evaluator workers send it back to the parent).
+        """
+        with self._lock:
+            baseline = self._poll_memory()
+            running = self._running[task_id] = _Running(baseline)
+        watch_helper_cpu(task_id)
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - running.start
+            cpu = time.thread_time() - running.cpu_start + pop_helper_cpu(task_id)
+            with self._lock:
+                self._poll_memory()
+                self._running.pop(task_id, None)
+            entry = {
+                "task_id": task_id,
+                **info,
+                "wall_s": round(wall, 4),
+                "cpu_s": round(cpu, 4),
+                "peak_mb": round(max(0, running.peak - running.baseline) / MB, 3),
+                "samples": sum(running.stacks.values()),
+                "top_stacks": [[stack, n] for stack, n in running.stacks.most_common(3)],
+            }
+            if self.memory_mb and entry["peak_mb"] >= self.memory_mb and tracemalloc.is_tracing():
+                # what is still alive from the spike (only taken for memory outliers; snapshots are costly)
+                stats = tracemalloc.take_snapshot().statistics("lineno")[:5]
+                entry["alloc_sites"] = [[str(s.traceback[0]), round(s.size / MB, 3)] for s in stats]
+            (sink or self.add_entry)(entry)
+
+    def add_entry(self, entry: dict):
+        """Record a finished task in the ledger, the outlier list and the top-N tables."""
+        flags = []
+        if self.slow_s and entry["wall_s"] >= self.slow_s:
+            flags.append("slow")
+        if self.memory_mb and entry["peak_mb"] >= self.memory_mb:
+            flags.append("memory")
+        entry["outlier"] = flags
+        ledger_row = {k: v for k, v in entry.items() if k not in ("top_stacks", "alloc_sites")}
+        with self._lock:
+            self.tasks += 1
+            if flags:
+                self.outliers.append({"task_id": entry["task_id"], "flags": flags})
+            self._seq += 1
+            for heap, key in ((self._slowest, entry["wall_s"]), (self._largest, entry["peak_mb"])):
+                item = (key, self._seq, entry)
+                if len(heap) < self.top_n:
+                    heapq.heappush(heap, item)
+                elif heap and key > heap[0][0]:
+                    heapq.heapreplace(heap, item)
+            if self._ledger is not None:
+                self._ledger.write(json.dumps(ledger_row, ensure_ascii=False) + "\n")
+
+    # reporting
+
+    def report(self) -> dict:
+        with self._lock:
+            slowest = [entry for _, _, entry in sorted(self._slowest, key=lambda i: (-i[0], i[1]))]
+            largest = [entry for _, _, entry in sorted(self._largest, key=lambda i: (-i[0], i[1]))]
+            return {
+                "tasks": self.tasks,
+                "thresholds": {"slow_s": self.slow_s, "memory_mb": self.memory_mb},
+                "memory_tracked": self.memory,
+                "sample_interval_s": self.interval,
+                "outliers": list(self.outliers),
+                "slowest": slowest,
+                "largest": largest,
+                "ledger": self.ledger_path,
+            }
+
+    def write_report(self, path: str = None) -> dict:
+        report = self.report()
+        with open(path or self.report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        return report
+
+    def summary(self) -> str:
+        report = self.report()
+        lines = [f"Profiled {report['tasks']} tasks, {len(report['outliers'])} outliers "
+                 f"(slow >= {self.slow_s}s, memory >= {self.memory_mb} MB)"]
+        for entry in report["slowest"][:3]:
+            lines.append(f"  slowest: {entry['task_id']}  {entry['wall_s']:.2f}s  {entry['peak_mb']:.1f} MB")
+        return "\n".join(lines)
+
+
+# --- command line ----------------------------------------------------------------------------
+
+def add_profile_args(parser, default_report: str = "profile_report.json"):
+    parser.add_argument("--profile", action="store_true",
+                        help="profile every task (wall/CPU time, sampled call stacks) and write a report")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="also track each task's tracemalloc peak (slows allocation-heavy code noticeably)")
+    parser.add_argument("--profile-report", default=default_report,
+                        help="report with outliers and the top-N slowest/largest tasks; the ledger goes next to it")
+    parser.add_argument("--profile-interval", type=float, default=0.01, help="stack sampling period in seconds")
+    parser.add_argument("--profile-slow-s", type=float, default=60.0, help="flag tasks slower than this")
+    parser.add_argument("--profile-mem-mb", type=float, default=256.0,
+                        help="with --profile-memory, flag tasks whose traced memory peak grew by more than this")
+    parser.add_argument("--profile-top", type=int, default=10, help="how many slowest / largest tasks to report")
+
+
+def profiler_from_args(args):
+    """A started TaskProfiler when --profile was given, else None."""
+    if not args.profile:
+        return None
+    return TaskProfiler(
+        args.profile_report,
+        interval=args.profile_interval,
+        slow_s=args.profile_slow_s,
+        memory_mb=args.profile_mem_mb,
+        top_n=args.profile_top,
+        memory=args.profile_memory,
+    ).start()
+
+
+# --- evaluator worker processes -------------------------------------------------------------
+
+_worker_profiler = None
+
+
+def start_worker_profiler(interval: float, memory_mb: float, memory: bool = False, stack_depth: int = 12):
+    """ProcessPoolExecutor initializer: a sampler in each worker; entries go back with the results."""
+    global _worker_profiler
+    _worker_profiler = TaskProfiler(interval=interval, memory_mb=memory_mb, stack_depth=stack_depth,
+                                    memory=memory).start()
+
+
+def worker_profiler() -> TaskProfiler:
+    return _worker_profiler
@@ -0,0 +1,74 @@
+"""The single-pass AST fingerprinter must reproduce the evaluator's original subtree walk exactly."""
+import json
+from pathlib import Path
+import pytest
+from debug_evaluate import ast_score, extract_code, reference_subtrees
+from ast_fingerprint import SubtreeFingerprinter
+
+BUG_DATA = Path(__file__).resolve().parent.parent / "bug_data"
+
+
+def load_snippets():
+    snippets = []
+    for name in ("debug_dataset.jsonl", "repair_example.jsonl"):
+        with open(BUG_DATA / name, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    rec = json.loads(line)
+                    snippets.append((rec["task_id"], rec.get("code", ""), rec.get("Final answer", "")))
+    return snippets
+
+
+SNIPPETS = load_snippets()
+
+
+def reference_ast_score(pred_code: str, ref_code: str) -> float:
+    """ast_score as it was computed before fingerprinting."""
+    ref = reference_subtrees(ref_code)
+    if not ref:
+        return 0.0
+    return len(reference_subtrees(pred_code) & ref) / len(ref)
+
+
+def deep_snippet(depth: int) -> str:
+    return "void f(int x) {" + "if (x > 0) { x--; " * depth + "return;" + " }" * depth + " }"
+
+
+@pytest.mark.parametrize("task_id,buggy,fixed", SNIPPETS, ids=[s[0] for s in SNIPPETS])
+def test_signatures_match_reference(task_id, buggy, fixed):
+    fingerprinter = SubtreeFingerprinter()
+    for code in (buggy, fixed, extract_code(fixed)):
+        assert fingerprinter.signatures(code) == reference_subtrees(code)
+
+
+@pytest.mark.parametrize("task_id,buggy,fixed", SNIPPETS, ids=[s[0] for s in SNIPPETS])
+def test_ast_score_unchanged(task_id, buggy, fixed):
+    assert ast_score(buggy, fixed) == reference_ast_score(buggy, fixed)
+    assert ast_score(fixed, fixed) == reference_ast_score(fixed, fixed)
+
+
+def test_deep_tree():
+    # deep enough to exercise long parent chains; the quadratic reference walk keeps it from going much deeper
+    code = deep_snippet(60)
+    signatures = SubtreeFingerprinter().signatures(code)
+    assert signatures
+    assert signatures == reference_subtrees(code)
+    assert ast_score(code, deep_snippet(3)) == reference_ast_score(code, deep_snippet(3))
+
+
+def test_unparsable_snippet_scores_zero():
+    assert SubtreeFingerprinter().signatures("public class {") == set() == reference_subtrees("public class {")
+    assert ast_score("int x = 1;", "public class {") == 0.0
+
+
+def test_signatures_are_interned_once():
+    fingerprinter = SubtreeFingerprinter()
+    code = SNIPPETS[0][2]
+    first = fingerprinter.fingerprint(code)
+    interned = len(fingerprinter._signatures)
+    assert interned == len(first)
+    assert fingerprinter.fingerprint(code) == first
+    assert len(fingerprinter._signatures) == interned
+    # signatures seen before (e.g. gold signatures from the cache) map back to the same ids
+    assert fingerprinter.ids(fingerprinter.signatures(code)) == first
+    assert len(fingerprinter._signatures) == interned
@@ -0,0 +1,48 @@
+"""Crash safety of the JSONL checkpoint: torn tails are cut off before new records are appended."""
+import json
+import pytest
+from checkpoint import CheckpointWriter, iter_offsets, load_completed, retire, retired_path_for
+
+
+def write_bytes(path, data: bytes):
+    path.write_bytes(data)
+    return str(path)
+
+
+def append_one(path: str, task_id: str = "new"):
+    with CheckpointWriter(path, fsync="never") as writer:
+        writer.write({"task_id": task_id, "submitted_answer": "x"})
+
+
+@pytest.mark.parametrize("existing,expected_ids", [
+    # crash during the very first write: no complete record at all
+    (b'{"task_id": "a", "submitted_ans', []),
+    # crash after some records
+    (b'{"task_id": "a"}\n{"task_id": "b", "subm', ["a"]),
+    # clean file
+    (b'{"task_id": "a"}\n{"task_id": "b"}\n', ["a", "b"]),
+    # empty file
+    (b"", []),
+])
+def test_torn_tail_is_truncated(tmp_path, existing, expected_ids):
+    path = write_bytes(tmp_path / "run.checkpoint.jsonl", existing)
+    append_one(path)
+    lines = (tmp_path / "run.checkpoint.jsonl").read_bytes().splitlines(keepends=True)
+    assert all(line.endswith(b"\n") for line in lines)
+    assert [json.loads(line)["task_id"] for line in lines] == expected_ids + ["new"]
+    assert [rec["task_id"] for _, rec in iter_offsets(path)] == expected_ids + ["new"]
+
+
+def test_torn_tail_of_first_write_is_not_glued_to_the_next_record(tmp_path):
+    path = write_bytes(tmp_path / "run.checkpoint.jsonl", b'{"task_id": "a", "subm')
+    append_one(path, "b")
+    assert load_completed(path) == {"b"}
+
+
+def test_retire_moves_the_checkpoint_aside(tmp_path):
+    path = str(tmp_path / "run.checkpoint.jsonl")
+    append_one(path, "a")
+    done = retire(path)
+    assert done == retired_path_for(path) == str(tmp_path / "run.checkpoint.done.jsonl")
+    assert load_completed(path) == set()
+    assert load_completed(done) == {"a"}
@@ -0,0 +1,48 @@
+"""iter_json_array must give json.loads' result whatever the chunk size, even when values are cut mid-token."""
+import io
+import json
+import pytest
+from streaming_json import iter_json_array, iter_records
+
+DOCUMENTS = [
+    "[]",
+    " [ ] ",
+    "[7]",
+    "[1.5e10, -3]",
+    "[-0.25,1E-7 ,6.02e+23, 0, -0.0, 12345678901234567890]",
+    '["a,b]", "esc \\" \\\\ \\u00e9", "", "é ünïcode ✓"]',
+    '[{"x": [1, 2.5, {"y": null}]}, [[], [[-1e-3]]], true, false, null]',
+    '[\n  {"task_id": "t1", "submitted_answer": "FINAL ANSWER: 3.14"},\n  {"task_id": "t2", "submitted_answer": "x"}\n]\n',
+]
+CHUNK_SIZES = [1, 2, 3, 4, 5, 7, 16, 1 << 16]
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+@pytest.mark.parametrize("document", DOCUMENTS)
+def test_matches_json_loads(document, chunk_size):
+    assert list(iter_json_array(io.StringIO(document), chunk_size)) == json.loads(document)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3])
+def test_number_cut_after_partial_token_is_not_split(chunk_size):
+    # "1." / "1.5e" / "-" at a chunk boundary used to decode as a shorter number
+    values = list(iter_json_array(io.StringIO("[1.5e10, -3, 2.75, -4e-2]"), chunk_size))
+    assert values == [1.5e10, -3, 2.75, -4e-2]
+    assert [type(v) for v in values] == [float, int, float, float]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1 << 16])
+@pytest.mark.parametrize("document", ["{}", "[1 2]", "[1,", "[1.5e10 x]", '["open'])
+def test_malformed_input_raises(document, chunk_size):
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO(document), chunk_size))
+
+
+def test_iter_records_reads_json_and_jsonl(tmp_path):
+    records = [{"task_id": "a", "value": -1.5e3}, {"task_id": "b", "value": [1, {"c": "d"}]}]
+    as_json = tmp_path / "answers.json"
+    as_json.write_text(json.dumps(records), encoding="utf-8")
+    as_jsonl = tmp_path / "answers.jsonl"
+    as_jsonl.write_text("\n".join(json.dumps(r) for r in records) + "\n\n", encoding="utf-8")
+    assert list(iter_records(str(as_json))) == records
+    assert list(iter_records(str(as_jsonl))) == records
@@ -0,0 +1,106 @@
+import os
+import re
+import time
+import zlib
+import struct
+import functools
+import threading
+from concurrent.futures import Future
+from disk_cache import DiskCache, request_key
+
+# How long a recorded result stays fresh, per tool (seconds)
+TOOL_TTLS = {
+    "wiki_search": 7 * 24 * 3600,
+    "web_search": 24 * 3600,
+    "arvix_search": 30 * 24 * 3600,
+}
+DEFAULT_TTL = 24 * 3600
+
+# TOOL_CACHE_MODE:
+#   on     - serve fresh entries, call the tool on a miss and record the result (default)
+#   off    - always call the tool, never read or write the cache
+#   replay - never touch the network; serve recorded results regardless of age
+MODES = ("on", "off", "replay")
+
+_HEADER = struct.Struct("<d")  # stored-at timestamp in front of the compressed payload
+
+
+def normalize_query(query: str) -> str:
+    """Case-fold, collapse whitespace and trim surrounding punctuation so trivial variants share an entry."""
+    query = re.sub(r"\s+", " ", query.casefold()).strip()
+    return query.strip(" \"'.,;:?!")
+
+
+class ToolCache:
+    def __init__(self, path: str, mode: str = "on", max_bytes: int = 512 * 1024 * 1024):
+        if mode not in MODES:
+            raise ValueError(f"TOOL_CACHE_MODE must be one of {MODES}, got {mode!r}")
+        self.mode = mode
+        self.store = DiskCache(path, max_bytes=max_bytes, bypass=(mode == "off"))
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def _load(self, key: str, ttl: float):
+        raw = self.store.get(key)
+        if raw is None:
+            return None
+        (stored_at,) = _HEADER.unpack_from(raw)
+        if self.mode != "replay" and time.time() - stored_at > ttl:
+            return None
+        return zlib.decompress(raw[_HEADER.size:]).decode("utf-8")
+
+    def _save(self, key: str, text: str):
+        self.store.set(key, _HEADER.pack(time.time()) + zlib.compress(text.encode("utf-8"), 6))
+
+    def call(self, tool_name: str, query: str, fn):
+        """Return fn(query) through the cache; concurrent identical misses share one in-flight call."""
+        if self.mode == "off":
+            return fn(query)
+        key = request_key({"tool": tool_name, "query": normalize_query(query)})
+        cached = self._load(key, TOOL_TTLS.get(tool_name, DEFAULT_TTL))
+        if cached is not None:
+            return cached
+        if self.mode == "replay":
+            return f"No recorded {tool_name} result for: {query}"
+
+        with self._lock:
+            pending = self._in_flight.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._in_flight[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return pending.result()
+
+        try:
+            text = fn(query)
+            self._save(key, text)
+            pending.set_result(text)
+            return text
+        except BaseException as e:
+            pending.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def stats(self) -> dict:
+        return {**self.store.stats(), "coalesced": self.coalesced, "mode": self.mode}
+
+
+tool_cache = ToolCache(
+    os.environ.get("TOOL_CACHE_PATH", ".cache/tool_results.sqlite"),
+    mode=os.environ.get("TOOL_CACHE_MODE", "on"),
+)
+
+
+def cached_tool(tool_name: str):
+    """Decorator for a `(input: str) -> str` tool function; apply it underneath @tool."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(input: str) -> str:
+            return tool_cache.call(tool_name, input, fn)
+        return wrapper
+    return decorator